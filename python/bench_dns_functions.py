@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Measure how many filter list lines per second dns_functions.classify_line
+handles for each kind of rule"""
+#
+# Python Script:: bench_dns_functions.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+
+import argparse
+import time
+import dns_functions
+
+
+# A line template for each kind of rule, filled in with a line number
+RULE_TYPE_LINES = {
+    "adguard": "||ads{0}.example.com^\n",
+    "exception": "@@||ok{0}.example.com^\n",
+    "wildcard": "||*.cdn{0}.example.com^\n",
+    "hosts_0.0.0.0": "0.0.0.0 tracker{0}.example.net\n",
+    "hosts_127.0.0.1": "127.0.0.1 tracker{0}.example.net\n",
+    "plain": "host{0}.example.org\n",
+    "comment": "! Comment number {0}\n",
+    "blank": "\n",
+    "invalid": "not a rule {0}\n"
+}
+
+
+def bench_rule_type(template, line_count, repeat):
+    """
+    Time classify_line over a batch of lines of a single kind
+
+    Args:
+    template: A RULE_TYPE_LINES template
+    line_count: How many lines to classify per run
+    repeat: How many runs to take the fastest of
+
+    Returns:
+    lines_per_second: How many lines the fastest run classified per second
+    """
+    lines = [template.format(number) for number in range(line_count)]
+    classify_line = dns_functions.classify_line
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            classify_line(line)
+        best = min(best, time.perf_counter() - start)
+    return line_count / best
+
+
+def main(rule_types, line_count=100000, repeat=5):
+    """
+    The main function where all code is called from
+
+    Args:
+    rule_types: The RULE_TYPE_LINES keys to measure (Every type if empty)
+    line_count: How many lines to classify per run
+    repeat: How many runs of each type to take the fastest of
+
+    Returns:
+    results: A dictionary of each rule type and its lines per second
+    """
+    results = {}
+    print("%-18s %14s" % ("rule type", "lines/second"))
+    for rule_type in rule_types or list(RULE_TYPE_LINES):
+        results[rule_type] = bench_rule_type(RULE_TYPE_LINES[rule_type], line_count, repeat)
+        print("%-18s %14.0f" % (rule_type, results[rule_type]))
+    return results
+
+
+if __name__ == '__main__':
+    # This function parses and return arguments passed in
+    # Assign description to the help doc
+    PARSER = argparse.ArgumentParser(
+        description='Measure how fast filter list lines are classified per rule type.')
+    # Add arguments
+    PARSER.add_argument(
+        '-t', '--ruleTypes', type=str, nargs='+', default=[], choices=list(RULE_TYPE_LINES),
+        help="The rule types to measure (Every type by default)", required=False
+    )
+    PARSER.add_argument(
+        '-n', '--lines', type=int, default=100000,
+        help="How many lines to classify per run", required=False
+    )
+    PARSER.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help="How many runs of each rule type to take the fastest of", required=False
+    )
+    # Array for all arguments passed to script
+    ARGS = PARSER.parse_args()
+    # Assign args to variables
+    ARG_RULE_TYPES = ARGS.ruleTypes
+    ARG_LINES = ARGS.lines
+    ARG_REPEAT = ARGS.repeat
+    main(ARG_RULE_TYPES, ARG_LINES, ARG_REPEAT)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Measure how long portfolio.py takes to value and summarize large
+synthetic portfolios"""
+#
+# Python Script:: bench_portfolio.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+
+import argparse
+import random
+import time
+from array import array
+import portfolio
+
+
+def build_holdings(position_count, symbol_count, seed=0):
+    """
+    Build random holdings shaped like load_holdings returns them
+
+    Args:
+    position_count: How many positions to hold
+    symbol_count: How many distinct symbols the positions are spread across
+    seed: The random seed so every run values the same portfolio
+
+    Returns:
+    holdings: A dictionary of holdings like load_holdings returns
+    coin_prices: A dictionary of a price for every symbol
+    """
+    rng = random.Random(seed)
+    symbols = [f"COIN{rng.randrange(symbol_count)}" for _ in range(position_count)]
+    positions = {}
+    for index, symbol in enumerate(symbols):
+        positions.setdefault(symbol, []).append(index)
+    holdings = {
+        "symbols": symbols,
+        "quantities": array("d", (rng.uniform(0, 10) for _ in range(position_count))),
+        "cost_bases": array("d", (rng.uniform(0, 1000) for _ in range(position_count))),
+        "positions": positions
+    }
+    coin_prices = {symbol: rng.uniform(0.01, 50000) for symbol in positions}
+    return holdings, coin_prices
+
+
+def main(position_counts, symbol_count=5000, repeat=3):
+    """
+    The main function where all code is called from
+
+    Args:
+    position_counts: The portfolio sizes to measure
+    symbol_count: How many distinct symbols each portfolio holds
+    repeat: How many runs of each size to take the fastest of
+    """
+    print("%12s %14s %14s" % ("positions", "value ms", "summarize ms"))
+    for position_count in position_counts:
+        holdings, coin_prices = build_holdings(position_count, symbol_count)
+        value_time = summary_time = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            valuation = portfolio.value_holdings(holdings, coin_prices)
+            middle = time.perf_counter()
+            portfolio.summarize_by_symbol(holdings, valuation)
+            end = time.perf_counter()
+            value_time = min(value_time, middle - start)
+            summary_time = min(summary_time, end - middle)
+        print("%12s %14.1f %14.1f" % (position_count, value_time * 1000, summary_time * 1000))
+
+
+if __name__ == '__main__':
+    # This function parses and return arguments passed in
+    # Assign description to the help doc
+    PARSER = argparse.ArgumentParser(
+        description='Measure portfolio valuation on large synthetic portfolios.')
+    # Add arguments
+    PARSER.add_argument(
+        '-n', '--positions', type=int, nargs='+', default=[10000, 1000000],
+        help="The portfolio sizes to measure", required=False
+    )
+    PARSER.add_argument(
+        '-s', '--symbols', type=int, default=5000,
+        help="How many distinct symbols each portfolio holds", required=False
+    )
+    PARSER.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help="How many runs of each size to take the fastest of", required=False
+    )
+    # Array for all arguments passed to script
+    ARGS = PARSER.parse_args()
+    # Assign args to variables
+    ARG_POSITIONS = ARGS.positions
+    ARG_SYMBOLS = ARGS.symbols
+    ARG_REPEAT = ARGS.repeat
+    main(ARG_POSITIONS, ARG_SYMBOLS, ARG_REPEAT)
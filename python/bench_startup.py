@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Measure how long each script spends importing modules before it can print
+--help and check it against a per-script budget"""
+#
+# Python Script:: bench_startup.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+
+# The most milliseconds of imports each script may add on top of the interpreter's own
+STARTUP_BUDGETS = {
+    "crypto_pricing.py": 60,
+    "dns_to_terraform.py": 60,
+    "list_coinbase_pro_txs.py": 60,
+    "portfolio.py": 60,
+    "price_history.py": 60,
+    "pug_finder.py": 120,
+    "unfollow_github_org.py": 60
+}
+# Third-party packages that must only be imported once a script has work to do
+HEAVY_MODULES = ["requests", "urllib3", "bs4", "lxml", "github", "googleapiclient",
+                 "google_auth_oauthlib"]
+# A line of python -X importtime output (self and cumulative times are in microseconds)
+IMPORT_TIME_REGEX = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+# The directory the scripts live in
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(args, python=sys.executable):
+    """
+    Run Python with -X importtime and read back what it imported
+
+    Args:
+    args: The arguments to run Python with
+    python: The Python interpreter to run
+
+    Returns:
+    total_ms: The cumulative milliseconds of every top-level import
+    modules: A list of every module that was imported
+    """
+    result = subprocess.run([python, "-X", "importtime"] + args, capture_output=True,
+                            text=True, cwd=SCRIPT_DIR, check=False)
+    total_ms = 0.0
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_REGEX.match(line)
+        if not match:
+            continue
+        modules.append(match.group(4))
+        # Nested imports are indented and already counted in their parent's cumulative time
+        if len(match.group(3)) == 1:
+            total_ms += int(match.group(2)) / 1000
+    return total_ms, modules
+
+
+def measure_startup(script, repeat=5, python=sys.executable):
+    """
+    Measure how many milliseconds of imports a script adds before printing --help
+
+    Args:
+    script: The file name of the script in SCRIPT_DIR
+    repeat: How many runs to take the fastest of
+    python: The Python interpreter to run
+
+    Returns:
+    startup_ms: The fastest script import time less the fastest interpreter import time
+    heavy_modules: The HEAVY_MODULES the script imported
+    """
+    baseline_ms = min(import_times(["-c", "pass"], python)[0] for _ in range(repeat))
+    runs = [import_times([script, "--help"], python) for _ in range(repeat)]
+    heavy_modules = sorted({module.split(".")[0] for module in runs[0][1]}
+                           .intersection(HEAVY_MODULES))
+    return max(0.0, min(run[0] for run in runs) - baseline_ms), heavy_modules
+
+
+def main(scripts, repeat=5):
+    """
+    The main function where all code is called from
+
+    Args:
+    scripts: The scripts to measure (Every script in STARTUP_BUDGETS if empty)
+    repeat: How many runs of each script to take the fastest of
+
+    Returns:
+    over_budget: A list of the scripts that were over budget or imported a heavy module
+    """
+    over_budget = []
+    print("%-26s %10s %10s  %s" % ("script", "import ms", "budget ms", "heavy modules"))
+    for script in scripts or list(STARTUP_BUDGETS):
+        startup_ms, heavy_modules = measure_startup(script, repeat)
+        budget_ms = STARTUP_BUDGETS.get(script, min(STARTUP_BUDGETS.values()))
+        print("%-26s %10.1f %10s  %s" % (script, startup_ms, budget_ms,
+                                         ", ".join(heavy_modules) or "-"))
+        if startup_ms > budget_ms or heavy_modules:
+            over_budget.append(script)
+    if over_budget:
+        print("Over budget: %s" % ", ".join(over_budget))
+    return over_budget
+
+
+if __name__ == '__main__':
+    # This function parses and return arguments passed in
+    # Assign description to the help doc
+    PARSER = argparse.ArgumentParser(
+        description='Check how long each script takes to import what it needs for --help.')
+    # Add arguments
+    PARSER.add_argument(
+        '-s', '--scripts', type=str, nargs='+', default=[],
+        help="The scripts to measure (Every script with a budget by default)", required=False
+    )
+    PARSER.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help="How many runs of each script to take the fastest of", required=False
+    )
+    # Array for all arguments passed to script
+    ARGS = PARSER.parse_args()
+    # Assign args to variables
+    ARG_SCRIPTS = ARGS.scripts
+    ARG_REPEAT = ARGS.repeat
+    sys.exit(1 if main(ARG_SCRIPTS, ARG_REPEAT) else 0)
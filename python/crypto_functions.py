@@ -15,18 +15,265 @@
 
 import base64
 import datetime
+import email.utils
+import functools
 import json
+import random
+import re
+import sqlite3
+import threading
 import time
 import hmac
 import hashlib
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from requests.auth import AuthBase
+from urllib3.util.retry import Retry
 
 
 # List of tokens to use the Coinbase API for instead of CoinMarketCap
 COINBASE_TOKENS = ["BTC", "AERO", "ALGO", "DOGE", "XRP", "ADA", "ETH", "POL", "ALCX", "ENS"]
 # List of tokens that can't currently be tracked
 UNTRACKED_TOKENS = ["robot", "citadao"]
+# List of stablecoins that are always priced at $1 for the sake of math
+STABLE_TOKENS = ["DAI", "USDC", "GUSD"]
+# Coinbase API base URL
+COINBASE_API_URL = "https://api.coinbase.com/v2/"
+# Coinbase Pro API base URL
+CBPRO_API_URL = "https://api.pro.coinbase.com/"
+# The most records Coinbase Pro will return in a single page
+CBPRO_PAGE_SIZE = 100
+# CoinMarketCap API base URL
+COINMARKETCAP_API_URL = "https://pro-api.coinmarketcap.com/v1/"
+# The most slugs to ask CoinMarketCap about in a single request
+COINMARKETCAP_BATCH_SIZE = 100
+# The fractional seconds of a Coinbase Pro timestamp, which have their trailing zeros trimmed
+CBPRO_FRACTION_REGEX = re.compile(r"\.(\d+)")
+
+
+class TokenBucket:
+    """
+    A token bucket that lets bursts of calls through and then
+    refills at a steady rate
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, borrowing against the future if the bucket is empty
+        Returns:
+            wait_time: How many seconds the caller must wait before using the token
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+class RequestScheduler:
+    """
+    Route HTTP requests through a token bucket per API host and retry
+    throttled or failed requests, honouring Retry-After and otherwise
+    backing off exponentially with jitter
+    """
+    def __init__(self, rate_limits, max_retries=5, backoff_base=0.5, backoff_cap=30):
+        self.buckets = {host: TokenBucket(rate, burst)
+                        for host, (rate, burst) in rate_limits.items()}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "wait_time": 0.0,
+                      "queue_depth": 0, "max_queue_depth": 0}
+
+    def metrics(self):
+        """Get a snapshot of the scheduler's metrics
+        Returns:
+            metrics: A dictionary of request and retry counts, total seconds spent
+                waiting for a token and the current and highest queue depth
+        """
+        with self.lock:
+            return dict(self.stats)
+
+    def _wait_for_token(self, host):
+        """Block until the host's token bucket lets another request through"""
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            return
+        wait_time = bucket.reserve()
+        if wait_time <= 0:
+            return
+        with self.lock:
+            self.stats["queue_depth"] += 1
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"],
+                                                self.stats["queue_depth"])
+            self.stats["wait_time"] += wait_time
+        time.sleep(wait_time)
+        with self.lock:
+            self.stats["queue_depth"] -= 1
+
+    def _retry_delay(self, response, attempt):
+        """Work out how long to wait before retrying a request
+        Args:
+            response: The requests Response that failed
+            attempt: How many times the request has been retried already
+        Returns:
+            delay: The number of seconds to wait
+        """
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            if retry_after.isdigit():
+                return int(retry_after)
+            try:
+                retry_time = email.utils.parsedate_to_datetime(retry_after)
+                return max(0, (retry_time - datetime.datetime.now(
+                    datetime.timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+        # Full jitter keeps many clients from retrying in lockstep
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def request(self, method, url, session=None, **kwargs):
+        """Make an HTTP request once the host's rate limit allows it,
+        retrying on 429 and 5xx responses
+        Args:
+            method: The HTTP method
+            url: The URL to request
+            session: An optional requests Session to send the request with
+            kwargs: Any other arguments for requests
+        Returns:
+            response: The requests Response
+        """
+        host = urllib.parse.urlsplit(url).hostname
+        sender = session or requests
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_token(host)
+            with self.lock:
+                self.stats["requests"] += 1
+            response = sender.request(method, url, **kwargs)
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            if attempt == self.max_retries:
+                break
+            with self.lock:
+                self.stats["retries"] += 1
+            time.sleep(self._retry_delay(response, attempt))
+        return response
+
+
+# The requests per second and burst size allowed for each API host
+HOST_RATE_LIMITS = {
+    "api.coinbase.com": (10, 10),
+    "api.pro.coinbase.com": (15, 30),
+    "pro-api.coinmarketcap.com": (0.5, 30)
+}
+# The scheduler every request in this module goes through by default
+DEFAULT_SCHEDULER = RequestScheduler(HOST_RATE_LIMITS)
+
+
+class PriceCache:
+    """
+    An in-memory LRU cache of coin prices that expire after a TTL, optionally
+    backed by a SQLite file so separate processes can share prices
+    """
+    def __init__(self, ttl=60, max_entries=1024, db_path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.database = None
+        if db_path:
+            self.database = sqlite3.connect(db_path, check_same_thread=False)
+            self.database.execute("CREATE TABLE IF NOT EXISTS prices"
+                                  " (key TEXT PRIMARY KEY, price REAL, fetched REAL)")
+            self.database.commit()
+
+    def get(self, key):
+        """Get a cached price
+        Args:
+            key: The cache key of the price
+        Returns:
+            price: The cached price or None if it is missing or expired
+        """
+        with self.lock:
+            now = time.time()
+            entry = self.entries.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if self.database:
+                row = self.database.execute("SELECT price, fetched FROM prices WHERE key = ?",
+                                            (key,)).fetchone()
+                if row and now - row[1] < self.ttl:
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def set(self, key, price):
+        """Cache a price
+        Args:
+            key: The cache key of the price
+            price: The price to cache
+        """
+        with self.lock:
+            fetched = time.time()
+            self._remember(key, price, fetched)
+            if self.database:
+                self.database.execute("INSERT OR REPLACE INTO prices VALUES (?, ?, ?)",
+                                      (key, price, fetched))
+                self.database.commit()
+
+    def _remember(self, key, price, fetched):
+        """Store a price in memory and evict the least recently used prices"""
+        self.entries[key] = (price, fetched)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+def cached_prices(price_cache, source, coins, fetch_prices):
+    """Look coins up in a price cache and only fetch the ones that are missing
+    Args:
+        price_cache: A PriceCache or None to always fetch
+        source: The name of the price source used in the cache key
+        coins: A list of coins/tokens that we care about
+        fetch_prices: A function that takes a list of coins and returns a
+            dictionary of each coin and its current price
+    Returns:
+        coin_prices: A dictionary of each coin and its current price
+    """
+    coins = list(dict.fromkeys(coins))
+    if price_cache is None:
+        return fetch_prices(coins)
+    coin_prices = {}
+    missing_coins = []
+    for coin in coins:
+        price = price_cache.get(f"{source}:{coin}")
+        if price is None:
+            missing_coins.append(coin)
+        else:
+            coin_prices[coin] = price
+    if missing_coins:
+        fetched_prices = fetch_prices(missing_coins)
+        for coin, price in fetched_prices.items():
+            price_cache.set(f"{source}:{coin}", price)
+        coin_prices.update(fetched_prices)
+    return coin_prices
 
 
 # Create custom authentication for CoinbasePro
@@ -39,12 +286,14 @@ class CoinbaseProAuth(AuthBase):
         self.api_key = api_key
         self.secret_key = secret_key
         self.passphrase = passphrase
+        # Decode the key once and copy the keyed HMAC for every request
+        self.hmac_template = hmac.new(base64.b64decode(secret_key), digestmod=hashlib.sha256)
 
     def __call__(self, request):
         timestamp = str(time.time())
         message = timestamp + request.method + request.path_url + (request.body or b'').decode()
-        hmac_key = base64.b64decode(self.secret_key)
-        signature = hmac.new(hmac_key, message.encode(), hashlib.sha256)
+        signature = self.hmac_template.copy()
+        signature.update(message.encode())
         signature_b64 = base64.b64encode(signature.digest()).decode()
 
         request.headers.update({
@@ -66,14 +315,15 @@ class CoinbaseWalletAuth(AuthBase):
     def __init__(self, api_key, secret_key):
         self.api_key = api_key
         self.secret_key = secret_key
+        # Coinbase's code example is wrong. The key and message must be converted to bytes for HMAC
+        self.hmac_template = hmac.new(bytes(secret_key, 'latin-1'), digestmod=hashlib.sha256)
 
     def __call__(self, request):
         timestamp = str(int(time.time()))
         message = timestamp + request.method + request.path_url + (request.body or '')
-        # Coinbase's code example is wrong. The key and message must be converted to bytes for HMAC
-        key_bytes = bytes(self.secret_key, 'latin-1')
-        data_bytes = bytes(message, 'latin-1')
-        signature = hmac.new(key_bytes, data_bytes, hashlib.sha256).hexdigest()
+        signature = self.hmac_template.copy()
+        signature.update(bytes(message, 'latin-1'))
+        signature = signature.hexdigest()
 
         request.headers.update({
             'CB-ACCESS-SIGN': signature,
@@ -83,6 +333,187 @@ class CoinbaseWalletAuth(AuthBase):
         return request
 
 
+def make_session(pool_maxsize=10, max_retries=3, backoff_factor=0.5):
+    """Create a keep-alive requests Session that retries failed connections
+    (Throttled and failed responses are retried by the RequestScheduler)
+    Args:
+        pool_maxsize: How many connections to keep open per host
+        max_retries: How many times to retry a failed connection
+        backoff_factor: The base of the exponential backoff between retries in seconds
+    Returns:
+        session: A requests Session
+    """
+    session = requests.Session()
+    # urllib3 would otherwise retry 413, 429 and 503 responses that carry Retry-After
+    # itself, out of sight of the scheduler's token buckets and metrics
+    retries = Retry(total=max_retries, connect=max_retries, read=max_retries, status=0,
+                    backoff_factor=backoff_factor, respect_retry_after_header=False)
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_session():
+    """Get a keep-alive session shared by requests that don't bring their own
+    Returns:
+        session: A requests Session from make_session
+    """
+    return make_session()
+
+
+class CoinbaseClient:
+    """
+    A long-lived Coinbase APIv2 client that signs requests with a single
+    CoinbaseWalletAuth over a pooled keep-alive session
+    """
+    def __init__(self, coinbase_api_key, coinbase_api_secret, session=None, scheduler=None):
+        self.auth = CoinbaseWalletAuth(coinbase_api_key, coinbase_api_secret)
+        self.session = session or make_session()
+        self.scheduler = scheduler or DEFAULT_SCHEDULER
+
+    def get(self, api_query, **kwargs):
+        """Make a signed GET request to the Coinbase API
+        Args:
+            api_query: The path and query string after the API base URL
+        Returns:
+            result: The requests Response
+        """
+        return self.scheduler.request("GET", COINBASE_API_URL + api_query, self.session,
+                                      auth=self.auth, timeout=60, **kwargs)
+
+    def price_check(self, coin, price_cache=None):
+        """Check the price of a cryptocurrency against Coinbase
+        Args:
+            coin: The coin/token that we care about
+            price_cache: An optional PriceCache to reuse recent prices from
+        Returns:
+            coin_current_price: The current price of the coin
+        """
+        if price_cache:
+            coin_current_price = price_cache.get(f"coinbase:{coin}")
+            if coin_current_price is not None:
+                return coin_current_price
+        result = self.get("prices/%s-USD/spot" % coin)
+        coin_current_price = float(result.json()['data']['amount'])
+        if price_cache:
+            price_cache.set(f"coinbase:{coin}", coin_current_price)
+        return coin_current_price
+
+    def price_batch(self, coins, max_workers=8, price_cache=None):
+        """Check the prices of many cryptocurrencies against Coinbase concurrently
+        (The scheduler's token bucket for the host limits the request rate)
+        Args:
+            coins: A list of coins/tokens that we care about
+            max_workers: The most requests to have in flight at once
+            price_cache: An optional PriceCache to reuse recent prices from
+        Returns:
+            coin_prices: A list of each coin's current price in the same order as coins
+        """
+        def fetch_prices(missing_coins):
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return dict(zip(missing_coins, executor.map(self.price_check, missing_coins)))
+
+        coin_prices = cached_prices(price_cache, "coinbase", coins, fetch_prices)
+        return [coin_prices[coin] for coin in coins]
+
+
+class CoinbaseProClient:
+    """
+    A long-lived Coinbase Pro client that signs requests with a single
+    CoinbaseProAuth over a pooled keep-alive session
+    """
+    def __init__(self, cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase, session=None,
+                 scheduler=None):
+        self.auth = CoinbaseProAuth(cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase)
+        self.session = session or make_session()
+        self.scheduler = scheduler or DEFAULT_SCHEDULER
+
+    def get(self, api_query, **kwargs):
+        """Make a signed GET request to the Coinbase Pro API
+        Args:
+            api_query: The path and query string after the API base URL
+        Returns:
+            result: The requests Response
+        """
+        return self.scheduler.request("GET", CBPRO_API_URL + api_query, self.session,
+                                      auth=self.auth, timeout=60, **kwargs)
+
+    def tx_grab(self, hours):
+        """Grab all Coinbase Pro transactions in the last X hours
+        Args:
+            hours: How far back in hours you want to look
+
+        Returns:
+            result: Coinbase transactions as request Response
+        """
+        timestamp = (datetime.datetime.utcnow() - datetime.timedelta(hours=hours)).isoformat()
+        return self.get("transfers?before=%s" % timestamp)
+
+    def order_grab(self, hours):
+        """Grab all Coinbase Pro Orders in the last X hours
+        Args:
+            hours: How far back in hours you want to look
+
+        Returns:
+            result: Coinbase orders as request Response
+        """
+        timestamp = (datetime.datetime.utcnow() - datetime.timedelta(hours=hours)).isoformat()
+        return self.get('orders?status=done&before=%s' % timestamp)
+
+    def paginate(self, api_query, params, hours, since=None):
+        """Page through a Coinbase Pro list endpoint from newest to oldest
+        following the CB-AFTER cursor until records are older than X hours
+        (or older than since, so a delta sync never leaves a gap)
+        Args:
+            api_query: The endpoint to page through
+            params: Any extra query parameters for the endpoint
+            hours: How far back in hours you want to look
+            since: An optional timezone aware datetime to page back to instead of X hours
+
+        Yields:
+            record: A single record from the endpoint as a dictionary
+        """
+        cutoff = since or (datetime.datetime.now(datetime.timezone.utc)
+                           - datetime.timedelta(hours=hours))
+        params = dict(params, limit=CBPRO_PAGE_SIZE)
+        while True:
+            result = self.get(api_query, params=params)
+            result.raise_for_status()
+            records = result.json()
+            for record in records:
+                if parse_cbpro_time(record['created_at']) < cutoff:
+                    return
+                yield record
+            cursor = result.headers.get('CB-AFTER')
+            if not records or not cursor:
+                return
+            params['after'] = cursor
+
+    def tx_iter(self, hours, since=None):
+        """Stream all Coinbase Pro transactions in the last X hours page by page
+        Args:
+            hours: How far back in hours you want to look
+            since: An optional timezone aware datetime to page back to instead of X hours
+
+        Yields:
+            transaction: A single Coinbase Pro transfer as a dictionary
+        """
+        return self.paginate("transfers", {}, hours, since)
+
+    def order_iter(self, hours, since=None):
+        """Stream all Coinbase Pro Orders in the last X hours page by page
+        Args:
+            hours: How far back in hours you want to look
+            since: An optional timezone aware datetime to page back to instead of X hours
+
+        Yields:
+            order: A single Coinbase Pro order as a dictionary
+        """
+        return self.paginate("orders", {"status": "done"}, hours, since)
+
+
 def get_coinbase_creds_from_file(credentials_file):
     """Open a JSON file and get Coinbase credentials out of it
     Args:
@@ -117,47 +548,162 @@ def get_cbpro_creds_from_file(credentials_file):
     return cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase
 
 
-def coinmarketcap_price_check(cmc_api_key, coin):
+def coinmarketcap_price_check(cmc_api_key, coin, price_cache=None):
     """Check the price of a cryptocurrency against CoinMarketCap to see
     if it fell below the minimum price
     Args:
         cmc_api_key: The CoinMarketCap API key
         coin: The coin/token that we care about
+        price_cache: An optional PriceCache to reuse recent prices from
     Returns:
         coin_current_price: The current price of the coin
     """
-    request_url = (f"https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/"
+    if price_cache:
+        coin_current_price = price_cache.get(f"coinmarketcap:{coin}")
+        if coin_current_price is not None:
+            return coin_current_price
+    request_url = (f"{COINMARKETCAP_API_URL}cryptocurrency/quotes/"
                    f"latest?slug={coin}&convert=USD")
     headers = {
         "Accepts": "application/json",
         "X-CMC_PRO_API_KEY": cmc_api_key,
     }
 
-    response = requests.get(request_url, headers=headers, timeout=60)
+    response = DEFAULT_SCHEDULER.request("GET", request_url, get_default_session(),
+                                         headers=headers, timeout=60)
     data = response.json()
     for key in data["data"]:
         coin_current_price = data["data"][key]["quote"]["USD"]["price"]
+    if price_cache:
+        price_cache.set(f"coinmarketcap:{coin}", coin_current_price)
     return coin_current_price
 
 
+def coinmarketcap_price_batch(cmc_api_key, coins, price_cache=None):
+    """Check the prices of many cryptocurrencies against CoinMarketCap
+    using as few requests as possible
+    Args:
+        cmc_api_key: The CoinMarketCap API key
+        coins: A list of coin/token slugs that we care about
+        price_cache: An optional PriceCache to reuse recent prices from
+    Returns:
+        coin_prices: A dictionary of each coin's slug and its current price
+    """
+    return cached_prices(price_cache, "coinmarketcap", coins,
+                         lambda missing_coins: _coinmarketcap_fetch(cmc_api_key, missing_coins))
+
+
+def _coinmarketcap_fetch(cmc_api_key, coins):
+    """Fetch the prices of unique cryptocurrencies from CoinMarketCap in chunks.
+    Slugs CoinMarketCap doesn't know about are reported and left out
+    instead of failing the rest of their chunk
+    Args:
+        cmc_api_key: The CoinMarketCap API key
+        coins: A list of unique coin/token slugs
+    Returns:
+        coin_prices: A dictionary of each coin's slug and its current price
+    """
+    headers = {
+        "Accepts": "application/json",
+        "X-CMC_PRO_API_KEY": cmc_api_key,
+    }
+    coin_prices = {}
+    chunks = [coins[chunk_start:chunk_start + COINMARKETCAP_BATCH_SIZE]
+              for chunk_start in range(0, len(coins), COINMARKETCAP_BATCH_SIZE)]
+    while chunks:
+        chunk = chunks.pop()
+        request_url = f"{COINMARKETCAP_API_URL}cryptocurrency/quotes/latest"
+        response = DEFAULT_SCHEDULER.request("GET", request_url, get_default_session(),
+                                             headers=headers, timeout=60,
+                                             params={"slug": ",".join(chunk),
+                                                     "convert": "USD",
+                                                     "skip_invalid": "true"})
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        status = data.get("status") or {}
+        if not response.ok or status.get("error_code"):
+            if response.status_code == 400 and len(chunk) > 1:
+                # One bad slug rejects the whole request so ask for each one on its own
+                chunks.extend([coin] for coin in chunk)
+                continue
+            print("Error: CoinMarketCap returned %s for %s: %s" % (
+                status.get("error_code") or response.status_code, ",".join(chunk),
+                status.get("error_message")))
+            continue
+        for quote in (data.get("data") or {}).values():
+            price = quote.get("quote", {}).get("USD", {}).get("price")
+            if price is not None:
+                coin_prices[quote["slug"]] = price
+        unknown_coins = [coin for coin in chunk if coin not in coin_prices]
+        if unknown_coins:
+            print("Error: CoinMarketCap has no price for %s" % ",".join(unknown_coins))
+    return coin_prices
+
+
 def coinbase_price_check(coinbase_api_key, coinbase_api_secret,
-                         coin):
+                         coin, price_cache=None):
     """Check the price of a cryptocurrency against Coinbase to see
     if it fell below the minimum price
     Args:
         coinbase_api_key: An API key for Coinbase APIv2
         coinbase_api_secret: An API secret for Coinbase APIv2
         coin: The coin/token that we care about
+        price_cache: An optional PriceCache to reuse recent prices from
     Returns:
         coin_current_price: The current price of the coin
     """
     # Instantiate Coinbase API and query the price
-    api_url = 'https://api.coinbase.com/v2/'
-    coinbase_auth = CoinbaseWalletAuth(coinbase_api_key, coinbase_api_secret)
-    api_query = "prices/%s-USD/spot" % coin
-    result = requests.get(api_url + api_query, auth=coinbase_auth, timeout=60)
-    coin_current_price = float(result.json()['data']['amount'])
-    return coin_current_price
+    coinbase_client = CoinbaseClient(coinbase_api_key, coinbase_api_secret)
+    return coinbase_client.price_check(coin, price_cache)
+
+
+def coinbase_price_batch(coinbase_api_key, coinbase_api_secret, coins,
+                         max_workers=8, price_cache=None):
+    """Check the prices of many cryptocurrencies against Coinbase concurrently
+    over a single keep-alive session
+    Args:
+        coinbase_api_key: An API key for Coinbase APIv2
+        coinbase_api_secret: An API secret for Coinbase APIv2
+        coins: A list of coins/tokens that we care about
+        max_workers: The most requests to have in flight at once
+        price_cache: An optional PriceCache to reuse recent prices from
+    Returns:
+        coin_prices: A list of each coin's current price in the same order as coins
+    """
+    coinbase_client = CoinbaseClient(coinbase_api_key, coinbase_api_secret,
+                                     make_session(pool_maxsize=max_workers))
+    return coinbase_client.price_batch(coins, max_workers, price_cache)
+
+
+def resolve_prices(cmc_api_key, coinbase_client, coins, price_cache=None):
+    """Look up the prices of many coins in bulk, asking Coinbase about
+    COINBASE_TOKENS and CoinMarketCap about everything else
+    Args:
+        cmc_api_key: The CoinMarketCap API key
+        coinbase_client: A CoinbaseClient
+        coins: An iterable of coins/tokens that we care about
+        price_cache: An optional PriceCache to reuse recent prices from
+    Returns:
+        coin_prices: A dictionary of each coin and its current price
+        (Coins CoinMarketCap doesn't know about are left out)
+    """
+    coins = list(dict.fromkeys(coins))
+    # Hard-code stablecoins to $1 and coins we can't currently track well to $0
+    coin_prices = {coin: 1 for coin in coins if coin in STABLE_TOKENS}
+    coin_prices.update({coin: 0 for coin in coins if coin in UNTRACKED_TOKENS})
+    coinbase_coins = [coin for coin in coins if coin in COINBASE_TOKENS]
+    cmc_coins = [coin for coin in coins if coin not in coin_prices
+                 and coin not in COINBASE_TOKENS]
+    # Resolve every Coinbase coin concurrently while CoinMarketCap is asked in chunks
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        coinbase_prices = executor.submit(coinbase_client.price_batch, coinbase_coins,
+                                          price_cache=price_cache)
+        if cmc_coins:
+            coin_prices.update(coinmarketcap_price_batch(cmc_api_key, cmc_coins, price_cache))
+        coin_prices.update(zip(coinbase_coins, coinbase_prices.result()))
+    return coin_prices
 
 
 def cbpro_tx_grab(cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase, hours):
@@ -171,13 +717,8 @@ def cbpro_tx_grab(cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase, hours):
     Returns:
         result: Coinbase transactions as request Response
     """
-    # Instantiate Coinbase API and query the price
-    timestamp = (datetime.datetime.utcnow() - datetime.timedelta(hours=hours)).isoformat()
-    api_url = 'https://api.pro.coinbase.com/'
-    coinbase_auth = CoinbaseProAuth(cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase)
-    api_query = "transfers?before=%s" % timestamp
-    result = requests.get(api_url + api_query, auth=coinbase_auth, timeout=60)
-    return result
+    return CoinbaseProClient(cbpro_api_key, cbpro_api_secret,
+                             cbpro_api_passphrase).tx_grab(hours)
 
 
 def cbpro_order_grab(cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase, hours):
@@ -191,10 +732,57 @@ def cbpro_order_grab(cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase, hour
     Returns:
         result: Coinbase orders as request Response
     """
-    # Instantiate Coinbase API and query the price
-    timestamp = (datetime.datetime.utcnow() - datetime.timedelta(hours=hours)).isoformat()
-    api_url = 'https://api.pro.coinbase.com/'
-    coinbase_auth = CoinbaseProAuth(cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase)
-    api_query = 'orders?status=done&before=%s' % timestamp
-    result = requests.get(api_url + api_query, auth=coinbase_auth, timeout=60)
-    return result
+    return CoinbaseProClient(cbpro_api_key, cbpro_api_secret,
+                             cbpro_api_passphrase).order_grab(hours)
+
+
+def parse_cbpro_time(timestamp):
+    """Parse a Coinbase Pro timestamp such as 2021-06-13T16:54:04.337Z,
+    2021-06-13 16:54:04.337+00 or 2016-12-08 20:02:28.53864+00
+    Args:
+        timestamp: The timestamp string from the API
+
+    Returns:
+        parsed_time: A timezone aware datetime
+    """
+    timestamp = timestamp.replace(' ', 'T').replace('Z', '+00:00')
+    if timestamp[-3] in '+-':
+        timestamp += ':00'
+    # Before Python 3.11 fromisoformat only takes exactly 3 or 6 fractional digits
+    timestamp = CBPRO_FRACTION_REGEX.sub(lambda match: "." + match.group(1)[:6].ljust(6, "0"),
+                                         timestamp, count=1)
+    return datetime.datetime.fromisoformat(timestamp)
+
+
+def cbpro_tx_iter(cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase, hours,
+                  since=None):
+    """Stream all Coinbase Pro transactions in the last X hours page by page
+    Args:
+        cbpro_api_key: An API key for Coinbase Pro
+        cbpro_api_secret: An API secret for Coinbase Pro
+        cbpro_api_passphrase: An API passphrase for Coinbase Pro
+        hours: How far back in hours you want to look
+        since: An optional timezone aware datetime to page back to instead of X hours
+
+    Yields:
+        transaction: A single Coinbase Pro transfer as a dictionary
+    """
+    return CoinbaseProClient(cbpro_api_key, cbpro_api_secret,
+                             cbpro_api_passphrase).tx_iter(hours, since)
+
+
+def cbpro_order_iter(cbpro_api_key, cbpro_api_secret, cbpro_api_passphrase, hours,
+                     since=None):
+    """Stream all Coinbase Pro Orders in the last X hours page by page
+    Args:
+        cbpro_api_key: An API key for Coinbase Pro
+        cbpro_api_secret: An API secret for Coinbase Pro
+        cbpro_api_passphrase: An API passphrase for Coinbase Pro
+        hours: How far back in hours you want to look
+        since: An optional timezone aware datetime to page back to instead of X hours
+
+    Yields:
+        order: A single Coinbase Pro order as a dictionary
+    """
+    return CoinbaseProClient(cbpro_api_key, cbpro_api_secret,
+                             cbpro_api_passphrase).order_iter(hours, since)
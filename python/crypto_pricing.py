@@ -16,11 +16,78 @@
 
 import argparse
 import datetime
+import json
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-import crypto_functions
+import re
+import signal
+import threading
+import time
+import price_history
+# The Google client libraries and crypto_functions (which pulls in requests) are slow to
+# import so they are only imported where they are used
+
+
+# The sheet ranges this script reads symbols from and writes prices and timestamps to
+SHEET_RANGES = {
+    "symbols": "Simple!H11:H51",
+    "prices": "Simple!J11:J51",
+    "timestamps": "Simple!L11:L51"
+}
+
+
+def load_sheet_ranges(ranges_file=None):
+    """
+    Load the sheet ranges from a JSON config file, falling back to SHEET_RANGES
+
+    Args:
+    ranges_file: An optional JSON file with "symbols", "prices" and "timestamps" ranges
+
+    Returns:
+    sheet_ranges: A dictionary of range names and ranges in the Sheet!A1:B2 format
+    """
+    sheet_ranges = dict(SHEET_RANGES)
+    if ranges_file:
+        with open(ranges_file, encoding="utf-8") as config_file:
+            sheet_ranges.update(json.load(config_file))
+    return sheet_ranges
+
+
+def read_sheet_ranges(google_sheet, sheet_id, sheet_ranges):
+    """
+    Read many Google Sheet ranges in a single batchGet request
+
+    Args:
+    google_sheet: A Google service.spreadsheet object
+    sheet_id: The unique ID of the Google Sheet
+    sheet_ranges: A list of ranges in the Sheet!A1:B2 format
+
+    Returns:
+    values: A list of each range's rows in the same order as sheet_ranges
+    """
+    result = google_sheet.values().batchGet(spreadsheetId=sheet_id,
+                                            ranges=sheet_ranges).execute()
+    return [value_range.get('values', []) for value_range in result.get('valueRanges', [])]
+
+
+def update_sheet_ranges(google_sheet, sheet_id, updates):
+    """
+    Update many Google Sheet ranges in a single batchUpdate request
+
+    Args:
+    google_sheet: A Google service.spreadsheet object
+    sheet_id: The unique ID of the Google Sheet
+    updates: A dictionary of ranges in the Sheet!A1:B2 format and lists of rows
+    """
+    send_body = {
+        "valueInputOption": "USER_ENTERED",
+        "data": [{
+            "range": sheet_range,
+            "majorDimension": "ROWS",
+            "values": content
+        } for sheet_range, content in updates.items()]
+    }
+    _ = google_sheet.values().batchUpdate(spreadsheetId=sheet_id, body=send_body).execute()
 
 
 def update_sheet_column(google_sheet, sheet_id, sheet_range, content):
@@ -33,29 +100,36 @@ def update_sheet_column(google_sheet, sheet_id, sheet_range, content):
     sheet_range: The range of content in the Sheet!A1:B2 format
     content: A Python list of values
     """
-    send_body = {
-        "range": sheet_range,
-        "majorDimension": "ROWS",
-        "values": content
-    }
-    _ = google_sheet.values().update(spreadsheetId=sheet_id,
-                                     range=sheet_range, valueInputOption='USER_ENTERED',
-                                     body=send_body).execute()
+    update_sheet_ranges(google_sheet, sheet_id, {sheet_range: content})
 
 
-def main(sheet_id, credentials_file, cmc_api_key, coinbase_creds_file):
+def range_cell(sheet_range, row_offset):
     """
-    The main function where all code is called from
+    Work out the A1 address of a single cell in a single column range
+
+    Args:
+    sheet_range: A single column range in the Sheet!A1:A2 format
+    row_offset: The row in the range counting from 0
+
+    Returns:
+    cell: The cell in the Sheet!A1 format
+    """
+    sheet_name, column, first_row = re.match(r"^(.*)!([A-Z]+)(\d+)", sheet_range).groups()
+    return "%s!%s%s" % (sheet_name, column, int(first_row) + row_offset)
+
+
+def get_google_sheet(credentials_file):
+    """
+    Auth to Google and build a Sheets service
 
     Args:
-    sheet_id: The UID of the Google Sheet
     credentials_file: The path to your Google credentials.json
-    cmc_api_key: The CoinMarketCap API key
-    coinbase_creds_file: The path to your Coinbase coinbase.json
+
+    Returns:
+    sheet: A Google service.spreadsheet object
     """
-    # NOTE: All ranges are hardcoded as this script is for a very specific use case
-    # Auth to Coinbase
-    coinbase_creds = crypto_functions.get_coinbase_creds_from_file(coinbase_creds_file)
+    from googleapiclient.discovery import build  # pylint: disable=import-outside-toplevel
+    import google_auth_oauthlib.flow  # pylint: disable=import-outside-toplevel
     # Auth to Google using https://developers.google.com/sheets/api/quickstart/python
     google_creds = None
     # The file token.pickle stores the user's access token, and is
@@ -66,41 +140,145 @@ def main(sheet_id, credentials_file, cmc_api_key, coinbase_creds_file):
             google_creds = pickle.load(token)
     # If there are no (valid) credentials available, let the user log in.
     if not google_creds or not google_creds.valid:
-        flow = InstalledAppFlow.from_client_secrets_file(
+        flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(
             credentials_file, "https://www.googleapis.com/auth/spreadsheets")
         google_creds = flow.run_local_server(port=0)
         # Save the credentials for the next run
         with open('token.pickle', 'wb') as token:
             pickle.dump(google_creds, token)
 
-    service = build('sheets', 'v4', credentials=google_creds)
+    # Use the discovery document bundled with googleapiclient instead of fetching it
+    service = build('sheets', 'v4', credentials=google_creds,
+                    static_discovery=True, cache_discovery=False)
+    return service.spreadsheets()
+
+
+def refresh_prices(sheet, sheet_id, sheet_ranges, cmc_api_key, coinbase_client,
+                   price_cache, last_prices=None, history_dir=None):
+    """
+    Look up the price of every symbol in the sheet and write them back,
+    only touching the cells whose price changed since last_prices
 
+    Args:
+    sheet: A Google service.spreadsheet object
+    sheet_id: The UID of the Google Sheet
+    sheet_ranges: A dictionary of "symbols", "prices" and "timestamps" ranges
+    cmc_api_key: The CoinMarketCap API key
+    coinbase_client: A crypto_functions.CoinbaseClient
+    price_cache: A crypto_functions.PriceCache
+    last_prices: The current_prices returned by the previous refresh (Writes every cell if None)
+    history_dir: An optional directory to append every tracked price to with price_history
+
+    Returns:
+    current_prices: The price of every row as written to the sheet
+    """
+    import crypto_functions  # pylint: disable=import-outside-toplevel
     # Call the Sheets API
-    sheet = service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=sheet_id,
-                                range="Simple!H11:H51").execute()
-    values = result.get('values', [])
+    values = read_sheet_ranges(sheet, sheet_id, [sheet_ranges["symbols"]])[0]
     current_prices = []
     date_range = []
     if not values:
         print('No data found.')
-    else:
-        for row in values:
-            # Hard-coding DAI/USDC/GUSD to always be $1 for the sake of math
-            if row[0] in ["DAI", "USDC", "GUSD"]:
-                current_prices.append([1])
-            # Hard code a zero value for coins we can't currently track well
-            elif row[0] in crypto_functions.UNTRACKED_TOKENS:
-                current_prices.append([0])
-            # Logic to use Coinbase for coins we want to skip CoinMarketCap for
-            elif row[0] in crypto_functions.COINBASE_TOKENS:
-                current_prices.append([crypto_functions.coinbase_price_check(
-                    coinbase_creds[0], coinbase_creds[1], row[0])])
-            else:
-                current_prices.append([crypto_functions.coinmarketcap_price_check(cmc_api_key, row[0])])
-            date_range.append([datetime.datetime.now().strftime("%m/%d/%Y %H:%M:%S")])
-        update_sheet_column(sheet, sheet_id, "Simple!J11:J51", current_prices)
-        update_sheet_column(sheet, sheet_id, "Simple!L11:L51", date_range)
+        return current_prices
+    # Resolve every coin in bulk before walking the rows
+    coin_prices = crypto_functions.resolve_prices(cmc_api_key, coinbase_client,
+                                                  [row[0] for row in values], price_cache)
+    print("Price cache hits: %s misses: %s" % (price_cache.hits, price_cache.misses))
+    print("Request metrics: %s" % crypto_functions.DEFAULT_SCHEDULER.metrics())
+    for row in values:
+        # Coins no source could price are left blank instead of failing the whole sheet
+        current_prices.append([coin_prices.get(row[0], "")])
+        date_range.append([datetime.datetime.now().strftime("%m/%d/%Y %H:%M:%S")])
+    if history_dir:
+        price_history.append_prices(history_dir, time.time(), {
+            row[0]: coin_prices[row[0]] for row in values
+            if row[0] in coin_prices and row[0] not in crypto_functions.UNTRACKED_TOKENS})
+    if last_prices is None or len(last_prices) != len(current_prices):
+        update_sheet_ranges(sheet, sheet_id, {
+            sheet_ranges["prices"]: current_prices,
+            sheet_ranges["timestamps"]: date_range
+        })
+        return current_prices
+    # Only send the cells that changed and their timestamps
+    updates = {}
+    for row_offset, (old_price, new_price) in enumerate(zip(last_prices, current_prices)):
+        if old_price != new_price:
+            updates[range_cell(sheet_ranges["prices"], row_offset)] = [new_price]
+            updates[range_cell(sheet_ranges["timestamps"], row_offset)] = [date_range[row_offset]]
+    if updates:
+        update_sheet_ranges(sheet, sheet_id, updates)
+    print("Updated %s of %s prices" % (len(updates) // 2, len(current_prices)))
+    return current_prices
+
+
+def run_daemon(refresh, interval):
+    """
+    Call refresh every interval seconds until SIGTERM or SIGINT arrives,
+    printing the latency of each cycle
+
+    Args:
+    refresh: A function that runs one refresh cycle
+    interval: How many seconds to wait between the start of each cycle
+    """
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    stats = {"cycles": 0, "total": 0.0, "min": float("inf"), "max": 0.0}
+    while not stop.is_set():
+        cycle_start = time.monotonic()
+        try:
+            refresh()
+        except Exception as err:  # pylint: disable=broad-except
+            print("Error: ", err)
+        latency = time.monotonic() - cycle_start
+        stats["cycles"] += 1
+        stats["total"] += latency
+        stats["min"] = min(stats["min"], latency)
+        stats["max"] = max(stats["max"], latency)
+        print("Cycle %s took %.2fs (min %.2fs avg %.2fs max %.2fs)" % (
+            stats["cycles"], latency, stats["min"],
+            stats["total"] / stats["cycles"], stats["max"]))
+        stop.wait(max(0, interval - latency))
+    print("Shutting down")
+
+
+def main(sheet_id, credentials_file, cmc_api_key, coinbase_creds_file,
+         price_cache_file=None, price_cache_ttl=60, ranges_file=None,
+         daemon_interval=None, history_dir=None):
+    """
+    The main function where all code is called from
+
+    Args:
+    sheet_id: The UID of the Google Sheet
+    credentials_file: The path to your Google credentials.json
+    cmc_api_key: The CoinMarketCap API key
+    coinbase_creds_file: The path to your Coinbase coinbase.json
+    price_cache_file: An optional SQLite file to share recent prices between runs
+    price_cache_ttl: How many seconds a cached price stays fresh
+    ranges_file: An optional JSON file to override SHEET_RANGES with
+    daemon_interval: If set, keep running and refresh every this many seconds
+    history_dir: An optional directory to record every fetched price in
+    """
+    import crypto_functions  # pylint: disable=import-outside-toplevel
+    sheet_ranges = load_sheet_ranges(ranges_file)
+    # Auth to Coinbase
+    coinbase_creds = crypto_functions.get_coinbase_creds_from_file(coinbase_creds_file)
+    coinbase_client = crypto_functions.CoinbaseClient(coinbase_creds[0], coinbase_creds[1])
+    price_cache = crypto_functions.PriceCache(ttl=price_cache_ttl, db_path=price_cache_file)
+    sheet = get_google_sheet(credentials_file)
+    if daemon_interval is None:
+        refresh_prices(sheet, sheet_id, sheet_ranges, cmc_api_key, coinbase_client, price_cache,
+                       history_dir=history_dir)
+        return
+    # Keep the credentials, Sheets service and sessions warm between cycles
+    state = {"last_prices": None}
+
+    def refresh():
+        state["last_prices"] = refresh_prices(sheet, sheet_id, sheet_ranges, cmc_api_key,
+                                              coinbase_client, price_cache,
+                                              state["last_prices"], history_dir)
+
+    run_daemon(refresh, daemon_interval)
 
 
 if __name__ == '__main__':
@@ -126,6 +304,32 @@ if __name__ == '__main__':
         '-s', '--sheetID', type=str,
         help="The Google Sheet UID", required=True
     )
+    PARSER.add_argument(
+        '-p', '--priceCacheFile', type=str, default=None,
+        help="A SQLite file to share recent prices between runs", required=False
+    )
+    PARSER.add_argument(
+        '-t', '--priceCacheTTL', type=int, default=60,
+        help="How many seconds a cached price stays fresh", required=False
+    )
+    PARSER.add_argument(
+        '-r', '--rangesFile', type=str, default=None,
+        help="A JSON file of the symbols, prices and timestamps sheet ranges",
+        required=False
+    )
+    PARSER.add_argument(
+        '-d', '--daemon', action='store_true',
+        help="Keep running and refresh prices on a schedule", required=False
+    )
+    PARSER.add_argument(
+        '-i', '--interval', type=price_history.positive_int, default=60,
+        help="How many seconds between refreshes in daemon mode", required=False
+    )
+    PARSER.add_argument(
+        '-H', '--historyDir', type=str, default=None,
+        help="A directory to record every fetched price in for price_history.py",
+        required=False
+    )
     # Array for all arguments passed to script
     ARGS = PARSER.parse_args()
     # Assign args to variables
@@ -133,4 +337,11 @@ if __name__ == '__main__':
     ARG_GOOGLE_CREDS = ARGS.googleCredsFile
     ARG_CMC_API_KEY = ARGS.coinMarketCapApiKey
     ARG_COINBASE_CREDS = ARGS.coinbaseCredsFile
-    main(ARG_SHEET_ID, ARG_GOOGLE_CREDS, ARG_CMC_API_KEY, ARG_COINBASE_CREDS)
+    ARG_PRICE_CACHE_FILE = ARGS.priceCacheFile
+    ARG_PRICE_CACHE_TTL = ARGS.priceCacheTTL
+    ARG_RANGES_FILE = ARGS.rangesFile
+    ARG_DAEMON_INTERVAL = ARGS.interval if ARGS.daemon else None
+    ARG_HISTORY_DIR = ARGS.historyDir
+    main(ARG_SHEET_ID, ARG_GOOGLE_CREDS, ARG_CMC_API_KEY, ARG_COINBASE_CREDS,
+         ARG_PRICE_CACHE_FILE, ARG_PRICE_CACHE_TTL, ARG_RANGES_FILE, ARG_DAEMON_INTERVAL,
+         ARG_HISTORY_DIR)
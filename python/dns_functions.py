@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Some DNS filter list functions for use in various scripts"""
+#
+# Python Script:: dns_functions.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+
+import re
+
+
+# The kinds of rule a filter list line can be classified as
+RULE_IGNORED = 0
+RULE_DOMAIN = 1
+RULE_EXCEPTION = 2
+RULE_WILDCARD = 3
+# RegEx for a valid domain
+VALID_DOMAIN_REGEX = re.compile("^((?!-)[A-Za-z0-9-]{1,63}(?<!-)\\.)+[A-Za-z]{2,6}")
+# Translation tables that strip the characters found in typical AdGuard rules
+ADGUARD_RULE_TABLE = str.maketrans('', '', '|^')
+ADGUARD_EXCEPTION_TABLE = str.maketrans('', '', '|@^')
+# Hosts file prefixes that point a domain at a black hole
+HOSTS_PREFIXES = ("127.0.0.1", "0.0.0.0")
+
+
+def is_line_domain(line_to_test: str) -> bool:
+    """
+   Check if a string is a valid domain
+
+   Args:
+   line_to_test: The string to test
+   """
+    return VALID_DOMAIN_REGEX.match(line_to_test) is not None
+
+
+def _classify_plain(line: str) -> (int, str):
+    """
+    Classify a line that may be a bare domain
+
+    Args:
+    line: The raw line from the filter list
+
+    Returns:
+    rule_kind: The kind of rule the line is
+    domain: The domain in the rule
+    """
+    domain = line.strip()
+    if VALID_DOMAIN_REGEX.match(domain):
+        return RULE_DOMAIN, domain
+    return RULE_IGNORED, domain
+
+
+def _classify_adguard(line: str) -> (int, str):
+    """
+    Classify a line that may be an AdGuard "||" rule
+
+    Args:
+    line: The raw line from the filter list
+
+    Returns:
+    rule_kind: The kind of rule the line is
+    domain: The domain in the rule
+    """
+    if not line.startswith("||"):
+        return _classify_plain(line)
+    domain = line.strip().translate(ADGUARD_RULE_TABLE)
+    if "*" in domain:
+        return RULE_WILDCARD, domain
+    return RULE_DOMAIN, domain
+
+
+def _classify_exception(line: str) -> (int, str):
+    """
+    Classify a line that may be an AdGuard "@@||" exception rule
+
+    Args:
+    line: The raw line from the filter list
+
+    Returns:
+    rule_kind: The kind of rule the line is
+    domain: The domain in the rule
+    """
+    if not line.startswith("@@||"):
+        return _classify_plain(line)
+    domain = line.strip().translate(ADGUARD_EXCEPTION_TABLE)
+    if "*" in domain:
+        return RULE_WILDCARD, domain
+    return RULE_EXCEPTION, domain
+
+
+def _classify_hosts(line: str) -> (int, str):
+    """
+    Classify a line that may be a hosts file entry
+
+    Args:
+    line: The raw line from the filter list
+
+    Returns:
+    rule_kind: The kind of rule the line is
+    domain: The domain in the rule
+    """
+    if not line.startswith(HOSTS_PREFIXES):
+        return _classify_plain(line)
+    # A domain that merely starts with the prefix is still a bare domain
+    result = _classify_plain(line)
+    if result[0] == RULE_DOMAIN:
+        return result
+    fields = line.split()
+    if len(fields) < 2:
+        return RULE_IGNORED, ''
+    return RULE_DOMAIN, fields[1]
+
+
+def _classify_comment(_line: str) -> (int, str):
+    """
+    Classify a comment line
+
+    Args:
+    _line: The raw line from the filter list
+
+    Returns:
+    rule_kind: The kind of rule the line is
+    domain: The domain in the rule
+    """
+    return RULE_IGNORED, ''
+
+
+# Dispatch table of line classifiers keyed by the first character of a line
+LINE_CLASSIFIERS = {
+    '|': _classify_adguard,
+    '@': _classify_exception,
+    '1': _classify_hosts,
+    '0': _classify_hosts,
+    '!': _classify_comment,
+    '#': _classify_comment,
+    '\n': _classify_comment,
+    '\r': _classify_comment,
+}
+
+
+def classify_line(line: str) -> (int, str):
+    """
+    Classify a single filter list line
+
+    Args:
+    line: The raw line from the filter list
+
+    Returns:
+    rule_kind: One of RULE_IGNORED, RULE_DOMAIN, RULE_EXCEPTION or RULE_WILDCARD
+    domain: The domain in the rule
+    """
+    if not line:
+        return RULE_IGNORED, ''
+    return LINE_CLASSIFIERS.get(line[0], _classify_plain)(line)
+
+
+def build_domain_trie(domains) -> dict:
+    """
+    Build a trie of domains keyed by their labels in reverse order
+    so every subdomain sits underneath its parent domain
+
+    Args:
+    domains: An iterable of domains
+
+    Returns:
+    trie: A nested dictionary where the '' key marks the end of a domain
+    """
+    trie = {}
+    for domain in domains:
+        node = trie
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+        node[''] = True
+    return trie
+
+
+def is_domain_covered(trie: dict, domain: str, include_self: bool = True) -> bool:
+    """
+    Check if a domain or one of its parent domains is in a domain trie
+
+    Args:
+    trie: A trie built by build_domain_trie
+    domain: The domain to check
+    include_self: Also count an exact match as covered
+
+    Returns:
+    covered: True if the domain is covered by the trie
+    """
+    labels = domain.split('.')
+    node = trie
+    for depth, label in enumerate(reversed(labels), start=1):
+        node = node.get(label)
+        if node is None:
+            return False
+        if '' in node and (include_self or depth < len(labels)):
+            return True
+    return False
+
+
+def collapse_domains(domains: list, exceptions: list = ()) -> list:
+    """
+    Drop domains that are already covered by a parent domain in the same list
+    or that are excepted by an exception rule
+
+    Args:
+    domains: The list of domains to filter
+    exceptions: The list of domains to make exceptions for
+
+    Returns:
+    collapsed_domains: The remaining domains in their original order
+    """
+    domain_trie = build_domain_trie(domains)
+    exception_trie = build_domain_trie(exceptions)
+    return [domain for domain in domains
+            if not is_domain_covered(domain_trie, domain, include_self=False)
+            and not is_domain_covered(exception_trie, domain)]
@@ -14,126 +14,686 @@
 #
 
 import logging
-import re
 import argparse
-import requests
+import functools
+import glob
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import dns_functions
+# requests is only needed for remote filter files so it is imported where it is used
 
 
-def is_line_domain(line_to_test: str) -> bool:
+# The header written to the top of every generated file
+TERRAFORM_HEADER = "Auto-generated file from converting a DNS filter list"
+# The description given to every generated variable
+TERRAFORM_DESCRIPTION = "ADD_A_DESCERIPTION"
+
+
+def lists_content_hash(variables: list) -> str:
     """
-   Check if a string is a valid domain
+    Compute a content hash of the variables in a Terraform file
+
+    Args:
+    variables: A list of (name, comment, entries) tuples
+
+    Returns:
+    content_hash: A SHA-256 hex digest of every variable
+    """
+    content_hash = hashlib.sha256()
+    for name, _, entries in variables:
+        content_hash.update(name.encode())
+        content_hash.update(b"\0")
+        content_hash.update("\n".join(entries).encode())
+        content_hash.update(b"\0")
+    return content_hash.hexdigest()
+
+
+def render_terraform_variable(name: str, comment: str, entries: list) -> str:
+    """
+    Render a list of domains as a Terraform list(string) variable
+
+    Args:
+    name: The name of the Terraform variable
+    comment: The comment to put above the variable
+    entries: The list of domains in the variable
+
+    Returns:
+    variable: The Terraform code for the variable
+    """
+    body = "".join([f"  \"{entry}\",\n" for entry in entries])
+    return (f'#{comment}\nvariable "{name}"'
+            f' {{\n  description = "{TERRAFORM_DESCRIPTION}"\n'
+            '  type = list(string)\n  default = [\n'
+            f'{body}  ]\n}}\n\n')
+
+
+def render_terraform_file(content_hash: str, variables: list, output_format: str) -> str:
+    """
+    Render a whole Terraform file as HCL or as Terraform JSON
+
+    Args:
+    content_hash: The content hash to put in the file header (Skipped if None)
+    variables: A list of (name, comment, entries) tuples
+    output_format: Either "hcl" or "json"
+
+    Returns:
+    output: The contents of the Terraform file
+    """
+    if output_format == "json":
+        header = TERRAFORM_HEADER
+        if content_hash:
+            header += f". Content hash: {content_hash}"
+        # Terraform JSON treats "//" properties as comments
+        return json.dumps({
+            "//": header,
+            "variable": {name: {
+                "description": TERRAFORM_DESCRIPTION,
+                "type": "list(string)",
+                "default": entries
+            } for name, _, entries in variables}
+        }, indent=2) + "\n"
+    output = [f"# {TERRAFORM_HEADER}\n"]
+    if content_hash:
+        output.append(f"# Content hash: {content_hash}\n")
+    output.append("\n\n")
+    for name, comment, entries in variables:
+        output.append(render_terraform_variable(name, comment, entries))
+    return "".join(output)
 
-   Args:
-   line_to_test: The string to test
-   """
-    # RegEx for a valid domain
-    valid_domain_regex = re.compile("^((?!-)[A-Za-z0-9-]{1,63}(?<!-)\\.)+[A-Za-z]{2,6}")
-    # Check if the line is a valid domain and return results
-    if re.search(valid_domain_regex, line_to_test):
-        return True
-    return False
+
+def read_terraform_hash(terraform_file: str) -> str:
+    """
+    Read the content hash out of the header of a Terraform file
+    previously written by save_lists_to_terraform
+
+    Args:
+    terraform_file: The path of your Terraform file
+
+    Returns:
+    content_hash: The content hash in the file header (None if missing)
+    """
+    if not os.path.exists(terraform_file):
+        return None
+    with open(terraform_file) as tf_input:
+        for line in itertools.islice(tf_input, 3):
+            if "Content hash: " in line:
+                return line.split("Content hash: ")[1][:64]
+    return None
 
 
-def save_lists_to_terraform(terraform_file: str,
-                            filtered_domains: list, filter_exceptions: list) -> None:
+def read_terraform_lists(terraform_file: str) -> dict:
     """
-   Convert domain lists in to terraform variables and saves them to a tf file
+    Read the domain lists back out of a Terraform file
+    previously written by save_lists_to_terraform
+
+    Args:
+    terraform_file: The path of your Terraform file
+
+    Returns:
+    lists: A dictionary of variable names and their lists of domains
+    """
+    lists = {}
+    current_list = None
+    if not os.path.exists(terraform_file):
+        return lists
+    with open(terraform_file) as tf_input:
+        if terraform_file.endswith(".json"):
+            variables = json.load(tf_input).get("variable", {})
+            return {name: variable["default"] for name, variable in variables.items()}
+        for line in tf_input:
+            if line.startswith("variable "):
+                current_list = lists.setdefault(line.split('"')[1], [])
+            elif line.startswith('  "') and current_list is not None:
+                current_list.append(line.strip()[1:-2])
+    return lists
+
+
+def replace_file(target_file: str, temp_file: str) -> None:
+    """
+    Atomically move a finished temporary file over its target
+    keeping the target's permissions
+
+    Args:
+    target_file: The path of the file to replace
+    temp_file: The path of the temporary file
+    """
+    if os.path.exists(target_file):
+        shutil.copymode(target_file, temp_file)
+    else:
+        os.chmod(temp_file, 0o644)
+    os.replace(temp_file, target_file)
+
+
+def write_terraform_file(terraform_file: str, variables: list, output_format: str) -> dict:
+    """
+    Write variables to a Terraform file only if they changed since the last run
+
+    Args:
+    terraform_file: The path to save your Terraform file to
+    variables: A list of (name, comment, entries) tuples
+    output_format: Either "hcl" or "json"
+
+    Returns:
+    summary: A dictionary of whether the file changed, its content hash and
+    how many domains were added and removed from each variable
+    """
+    content_hash = lists_content_hash(variables)
+    summary = {"changed": False, "content_hash": content_hash, "variables": {}}
+    for name, _, _ in variables:
+        summary["variables"][name] = {"added": 0, "removed": 0}
+    # The hash is the first thing in the file so unchanged lists are caught cheaply
+    if read_terraform_hash(terraform_file) == content_hash:
+        logging.info("%s is already up to date", terraform_file)
+        return summary
+    summary["changed"] = True
+    old_lists = read_terraform_lists(terraform_file)
+    for name, _, entries in variables:
+        old_entries = set(old_lists.pop(name, []))
+        new_entries = set(entries)
+        summary["variables"][name]["added"] = len(new_entries - old_entries)
+        summary["variables"][name]["removed"] = len(old_entries - new_entries)
+    # Variables that are no longer written count as fully removed
+    for name, old_entries in old_lists.items():
+        summary["variables"][name] = {"added": 0, "removed": len(set(old_entries))}
+    # Write to a temporary file and rename it so a failed run never leaves a partial file
+    output_dir = os.path.dirname(os.path.abspath(terraform_file))
+    with tempfile.NamedTemporaryFile('w', dir=output_dir, delete=False) as tf_output:
+        tf_output.write(render_terraform_file(content_hash, variables, output_format))
+    replace_file(terraform_file, tf_output.name)
+    return summary
+
+
+def shard_file_path(terraform_file: str, shard: int, shards: int, output_format: str) -> str:
+    """
+    Work out the path of a single shard's Terraform file
+
+    Args:
+    terraform_file: The path you want to output your Terraform code to
+    shard: The number of the shard
+    shards: The total number of shards
+    output_format: Either "hcl" or "json"
+
+    Returns:
+    shard_file: The path of the shard's Terraform file
+    """
+    base_path = terraform_file
+    for extension in (".tf.json", ".tf"):
+        if base_path.endswith(extension):
+            base_path = base_path[:-len(extension)]
+            break
+    if shards > 1:
+        base_path += f"_{shard}"
+    return base_path + (".tf.json" if output_format == "json" else ".tf")
+
+
+def remove_stale_shards(terraform_file: str, shard_files: list) -> list:
+    """
+    Delete the Terraform files an earlier run wrote with more shards or in the
+    other output format so Terraform doesn't load their lists as well
+
+    Args:
+    terraform_file: The path you want to output your Terraform code to
+    shard_files: The paths of every shard file this run wrote
+
+    Returns:
+    removed_files: The paths of the stale files that were deleted
+    """
+    base_path = shard_file_path(terraform_file, 0, 1, "hcl")[:-len(".tf")]
+    removed_files = []
+    for extension in (".tf", ".tf.json"):
+        for candidate in sorted(glob.glob(glob.escape(base_path) + "*" + extension)):
+            suffix = candidate[len(base_path):-len(extension)]
+            if candidate in shard_files or not (suffix == "" or (
+                    suffix.startswith("_") and suffix[1:].isdigit())):
+                continue
+            # Only files this script generated are ever deleted
+            with open(candidate) as tf_input:
+                if not any(TERRAFORM_HEADER in line for line in itertools.islice(tf_input, 3)):
+                    continue
+            logging.warning("Removing stale shard file %s", candidate)
+            os.remove(candidate)
+            removed_files.append(candidate)
+    return removed_files
+
+
+def shard_index(domain: str, shards: int, shard_by: str) -> int:
+    """
+    Pick the shard a domain belongs in
+
+    Args:
+    domain: The domain to place
+    shards: The total number of shards
+    shard_by: "hash" to spread domains evenly or "label" to keep every
+    subdomain of a zone in the same shard
+
+    Returns:
+    shard: The number of the shard
+    """
+    if shards == 1:
+        return 0
+    if shard_by == "label":
+        domain = ".".join(domain.rsplit(".", 2)[-2:])
+    return zlib.crc32(domain.encode()) % shards
+
+
+def shard_variables(domain_shards: list, filter_exceptions: list) -> list:
+    """
+    Build the list of variables for every shard's Terraform file
+
+    Args:
+    domain_shards: A list of domain lists, one per shard
+    filter_exceptions: The list of domains to add to the exceptions variable
+
+    Returns:
+    shard_variables: A list of (name, comment, entries) lists, one per shard
+    """
+    all_variables = []
+    for shard, entries in enumerate(domain_shards):
+        if len(domain_shards) > 1:
+            variables = [(f"filter_list_{shard}", f"Filter list shard {shard}", entries)]
+        else:
+            variables = [("filter_list", "Filter list", entries)]
+        all_variables.append(variables)
+    # Exceptions are small so they always live with the first shard
+    if filter_exceptions:
+        all_variables[0].append(("exception_list", "Exception list", filter_exceptions))
+    return all_variables
+
+
+def summarize_shards(shard_summaries: dict) -> dict:
+    """
+    Combine the summaries of every shard's Terraform file
+
+    Args:
+    shard_summaries: A dictionary of shard file paths and their summaries
+
+    Returns:
+    summary: A dictionary of whether any file changed, each file's content hash
+    and how many domains were added and removed from each list
+    """
+    summary = {
+        "changed": False,
+        "files": {},
+        "filter_list": {"added": 0, "removed": 0},
+        "exception_list": {"added": 0, "removed": 0}
+    }
+    for shard_file, shard_summary in shard_summaries.items():
+        summary["changed"] = summary["changed"] or shard_summary["changed"]
+        summary["files"][shard_file] = shard_summary["content_hash"]
+        for name, counts in shard_summary["variables"].items():
+            list_name = "exception_list" if name == "exception_list" else "filter_list"
+            summary[list_name]["added"] += counts["added"]
+            summary[list_name]["removed"] += counts["removed"]
+    return summary
+
+
+def save_lists_to_terraform(terraform_file: str, filtered_domains: list,
+                            filter_exceptions: list, shards: int = 1,
+                            shard_by: str = "hash", output_format: str = "hcl") -> dict:
+    """
+   Convert domain lists in to terraform variables and saves them to one or more
+   tf files, only rewriting files that changed since the last run
 
    Args:
    terraform_file: The path to save your Terraform file to
    filtered_domains: The list of domains to add to the filter variable
    filter_exceptions: The list of domains to add to the exceptions variable
+   shards: How many files to split the filter list across
+   shard_by: "hash" or "label" (See shard_index)
+   output_format: Either "hcl" or "json"
+
+   Returns:
+   summary: A dictionary of whether any file changed, how many domains
+   were added and removed from each list and the stale files that were deleted
    """
-    with open(terraform_file, 'w') as tf_output:
-        # Write the header of the file
-        tf_output.write('# Auto-generated file from converting a DNS filter list\n\n\n')
-        # Write the filter variable
-        tf_output.write('#Filter list\nvariable "filter_list"'
-                        ' {\n  description = "ADD_A_DESCERIPTION"\n'
-                        '  type = list(string)\n  default = [\n')
-        for entry in filtered_domains:
-            tf_output.write(f"  \"{entry}\",\n")
-        tf_output.write('  ]\n}\n\n')
-        if filter_exceptions:
-            # Write the exception variable
-            tf_output.write('#Exception list\nvariable "exception_list"'
-                            ' {\n  description = "ADD_A_DESCERIPTION"\n'
-                            '  type = list(string)\n  default = [\n')
-            for entry in filter_exceptions:
-                tf_output.write(f"  \"{entry}\",\n")
-            tf_output.write('  ]\n}\n\n')
-        tf_output.close()
+    domain_shards = [[] for _ in range(shards)]
+    for domain in filtered_domains:
+        domain_shards[shard_index(domain, shards, shard_by)].append(domain)
+    shard_summaries = {}
+    for shard, variables in enumerate(shard_variables(domain_shards, filter_exceptions)):
+        shard_file = shard_file_path(terraform_file, shard, shards, output_format)
+        shard_summaries[shard_file] = write_terraform_file(shard_file, variables, output_format)
+    summary = summarize_shards(shard_summaries)
+    summary["removed_files"] = remove_stale_shards(terraform_file, list(shard_summaries))
+    if summary["removed_files"]:
+        summary["changed"] = True
+    return summary
 
 
-def parse_filter_list(filter_file: str) -> [list, list]:
+def split_terraform_file(variables: list, output_format: str) -> (str, str):
     """
-    Open a local filter file and parse it
+    Render a Terraform file whose first variable is empty and split it
+    where that variable's entries go
 
     Args:
-    filter_file: The path to your filter file
+    variables: A list of (name, comment, entries) tuples
+    output_format: Either "hcl" or "json"
 
     Returns:
-    list_of_domains: The list of domains to filter
-    list_of_exceptions: THe list of domains to make exceptions for
+    head: Everything before the first variable's entries
+    tail: Everything after the first variable's entries
+    """
+    if output_format == "json":
+        head, tail = render_terraform_file(None, variables, "json").split("[]", 1)
+        return head + "[", "]" + tail
+    head, tail = render_terraform_file(None, variables, "hcl").split("  ]\n", 1)
+    return head, "  ]\n" + tail
+
+
+def stream_lists_to_terraform(terraform_file: str, filter_rules, shards: int = 1,
+                              shard_by: str = "hash", output_format: str = "hcl") -> dict:
+    """
+    Write filter rules to one or more tf files as they are parsed without
+    sorting or deduplicating them first
+
+    Args:
+    terraform_file: The path to save your Terraform file to
+    filter_rules: An iterable of (rule_kind, domain) tuples
+    shards: How many files to split the filter list across
+    shard_by: "hash" or "label" (See shard_index)
+    output_format: Either "hcl" or "json"
+
+    Returns:
+    summary: A dictionary of the files written, how many domains were
+    written to each list and the stale files that were deleted
+    """
+    summary = {
+        "changed": True,
+        "files": {},
+        "filter_list": {"added": 0, "removed": 0},
+        "exception_list": {"added": 0, "removed": 0}
+    }
+    exceptions = []
+    shard_files = [shard_file_path(terraform_file, shard, shards, output_format)
+                   for shard in range(shards)]
+    temp_files = []
+    # JSON needs a comma before every entry except the first
+    separators = ["\n        "] * shards
+    try:
+        for shard_file, variables in zip(shard_files,
+                                         shard_variables([[]] * shards, [])):
+            output_dir = os.path.dirname(os.path.abspath(shard_file))
+            temp_files.append(tempfile.NamedTemporaryFile('w', dir=output_dir,
+                                                          delete=False))
+            temp_files[-1].write(split_terraform_file(variables, output_format)[0])
+        for rule_kind, domain in filter_rules:
+            if rule_kind == dns_functions.RULE_EXCEPTION:
+                exceptions.append(domain)
+            elif rule_kind == dns_functions.RULE_DOMAIN:
+                shard = shard_index(domain, shards, shard_by)
+                if output_format == "json":
+                    temp_files[shard].write(separators[shard] + json.dumps(domain))
+                    separators[shard] = ",\n        "
+                else:
+                    temp_files[shard].write(f"  \"{domain}\",\n")
+                summary["filter_list"]["added"] += 1
+        # Exceptions are only known once every rule is read so they go in the tail
+        for shard, variables in enumerate(shard_variables([[]] * shards, exceptions)):
+            tail = split_terraform_file(variables, output_format)[1]
+            if output_format == "json" and separators[shard] != "\n        ":
+                tail = "\n      " + tail
+            temp_files[shard].write(tail)
+        summary["exception_list"]["added"] = len(exceptions)
+    finally:
+        for temp_file in temp_files:
+            temp_file.close()
+    for shard_file, temp_file in zip(shard_files, temp_files):
+        replace_file(shard_file, temp_file.name)
+        summary["files"][shard_file] = None
+    summary["removed_files"] = remove_stale_shards(terraform_file, shard_files)
+    return summary
+
+
+@functools.lru_cache(maxsize=None)
+def get_http_session():
+    """
+    Get a keep-alive HTTP session that is shared by every download in this process
+
+    Returns:
+    session: A requests Session
+    """
+    import requests  # pylint: disable=import-outside-toplevel
+    return requests.Session()
+
+
+def fetch_cached_filter(filter_url: str, cache_dir: str) -> str:
+    """
+    Download a remote filter file in to an on-disk cache using a conditional GET
+    so unchanged lists are not downloaded again
+
+    Args:
+    filter_url: The URL of your filter file
+    cache_dir: The directory to cache filter files in
+
+    Returns:
+    body_path: The path of the cached copy of the filter file
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_key = hashlib.sha256(filter_url.encode()).hexdigest()
+    body_path = os.path.join(cache_dir, cache_key + '.txt')
+    meta_path = os.path.join(cache_dir, cache_key + '.json')
+    headers = {'Accept-Encoding': 'gzip'}
+    # Only ask for a 304 if we actually have a body to fall back on
+    if os.path.exists(body_path) and os.path.exists(meta_path):
+        with open(meta_path) as meta_file:
+            metadata = json.load(meta_file)
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+    with get_http_session().get(filter_url, headers=headers, stream=True,
+                                timeout=60) as remote_source:
+        if remote_source.status_code == 304:
+            logging.info("%s is unchanged, using the cached copy", filter_url)
+            return body_path
+        remote_source.raise_for_status()
+        # Write the decompressed body to a temporary file and swap it in atomically
+        with tempfile.NamedTemporaryFile('wb', dir=cache_dir, delete=False) as body_file:
+            for chunk in remote_source.iter_content(chunk_size=65536):
+                body_file.write(chunk)
+        os.replace(body_file.name, body_path)
+        metadata = {
+            'url': filter_url,
+            'etag': remote_source.headers.get('ETag'),
+            'last_modified': remote_source.headers.get('Last-Modified')
+        }
+        with tempfile.NamedTemporaryFile('w', dir=cache_dir, delete=False) as meta_file:
+            json.dump(metadata, meta_file)
+        os.replace(meta_file.name, meta_path)
+    return body_path
+
+
+def read_filter_lines(filter_file: str, cache_dir: str = None):
+    """
+    Stream the lines of a local or remote filter file one at a time
+
+    Args:
+    filter_file: The path or URL to your filter file
+    cache_dir: The directory to cache remote filter files in (Disabled if None)
+
+    Yields:
+    line: A single line of the filter file
     """
-    list_of_domains = []
-    list_of_exceptions = []
     # Determine if the filter file is local or remote
     if filter_file.lower().startswith('http'):
         logging.info("The filter is a remote file")
-        remote_source = requests.get(filter_file)
-        with open("/tmp/filter.txt", 'wb') as remote_file:
-            remote_file.write(remote_source.content)
-            remote_file.close()
-        loaded_file = "/tmp/filter.txt"
-    else:
-        loaded_file = filter_file
-    # Parse the filter file
-    with open(loaded_file) as file:
-        lines = file.readlines()
-        for line in lines:
-            # If the line starts with "||" then it is an AdGuard rule
-            if line.startswith("||"):
-                # Strip out the characters found in a typical
-                # AdGuard rule along with any newline characters
-                domain = (re.sub('[|^]', '', line.strip()))
-                if "*" in domain:
-                    logging.warning("Unable to save %s due to a wildcard in the rule", domain)
-                else:
-                    logging.info("Saving %s to list of domains to filter", domain)
-                    list_of_domains.append(domain)
-            elif line.startswith("@@||"):
-                # Save this domain to an exceptions list
-                domain = (re.sub('[|@^]', '', line.strip()))
-                if "*" in domain:
-                    logging.warning("Unable to save %s due to a wildcard in the rule", domain)
-                else:
-                    logging.info("Saving %s to list of exception domains", domain)
-            elif is_line_domain(line.strip()):
-                domain = line.strip()
-                logging.info("Saving %s to list of domains to filter", domain)
-                list_of_domains.append(domain)
-            elif line.startswith("127.0.0.1") or line.startswith("0.0.0.0"):
-                domain = line.replace('127.0.0.1 ', '').replace('0.0.0.0 ', '').strip()
+        if not cache_dir:
+            with get_http_session().get(filter_file, stream=True,
+                                        timeout=60) as remote_source:
+                remote_source.raise_for_status()
+                # Remote lists are plain text, so fall back to UTF-8 if no charset is sent
+                if remote_source.encoding is None:
+                    remote_source.encoding = 'utf-8'
+                for line in remote_source.iter_lines(decode_unicode=True):
+                    yield line
+            return
+        filter_file = fetch_cached_filter(filter_file, cache_dir)
+    with open(filter_file, encoding='utf-8', errors='replace') as file:
+        for line in file:
+            yield line
+
+
+def iter_filter_rules(filter_files: list, cache_dir: str = None):
+    """
+    Stream the classified rules of one or more filter files one at a time
+
+    Args:
+    filter_files: The paths or URLs of your filter files
+    cache_dir: The directory to cache remote filter files in (Disabled if None)
+
+    Yields:
+    rule_kind: dns_functions.RULE_DOMAIN or dns_functions.RULE_EXCEPTION
+    domain: The domain in the rule
+    """
+    for filter_file in filter_files:
+        # Parse the filter file one line at a time
+        for line in read_filter_lines(filter_file, cache_dir):
+            rule_kind, domain = dns_functions.classify_line(line)
+            if rule_kind == dns_functions.RULE_DOMAIN:
                 logging.info("Saving %s to list of domains to filter", domain)
-                list_of_domains.append(domain)
-    return sorted(list_of_domains), sorted(list_of_exceptions)
+                yield rule_kind, domain
+            elif rule_kind == dns_functions.RULE_EXCEPTION:
+                logging.info("Saving %s to list of exception domains", domain)
+                yield rule_kind, domain
+            elif rule_kind == dns_functions.RULE_WILDCARD:
+                logging.warning("Unable to save %s due to a wildcard in the rule", domain)
+
+
+def collect_filter_rules(filter_file: str, cache_dir: str = None) -> (set, set):
+    """
+    Open a local or remote filter file and collect its rules in a single pass
+
+    Args:
+    filter_file: The path or URL to your filter file
+    cache_dir: The directory to cache remote filter files in (Disabled if None)
+
+    Returns:
+    domains: The set of domains to filter
+    exceptions: The set of domains to make exceptions for
+    """
+    domains = set()
+    exceptions = set()
+    for rule_kind, domain in iter_filter_rules([filter_file], cache_dir):
+        if rule_kind == dns_functions.RULE_DOMAIN:
+            domains.add(domain)
+        else:
+            exceptions.add(domain)
+    return domains, exceptions
 
 
-def main(filter_file: str, terraform_file: str):
+def parse_filter_list(filter_file: str, cache_dir: str = None) -> [list, list]:
+    """
+    Open a local or remote filter file and parse it in a single pass
+
+    Args:
+    filter_file: The path or URL to your filter file
+    cache_dir: The directory to cache remote filter files in (Disabled if None)
+
+    Returns:
+    list_of_domains: The list of domains to filter
+    list_of_exceptions: THe list of domains to make exceptions for
+    """
+    return parse_filter_lists([filter_file], cache_dir=cache_dir)
+
+
+def parse_filter_lists(filter_files: list, workers: int = None,
+                       cache_dir: str = None) -> [list, list]:
+    """
+    Fetch and parse many local or remote filter files in parallel
+    and merge them in to deduplicated lists
+
+    Args:
+    filter_files: The paths or URLs of your filter files
+    workers: The number of processes to use (Defaults to the CPU count)
+    cache_dir: The directory to cache remote filter files in (Disabled if None)
+
+    Returns:
+    list_of_domains: The list of domains to filter
+    list_of_exceptions: THe list of domains to make exceptions for
+    """
+    domains = set()
+    exceptions = set()
+    # Skip the process pool overhead when there is nothing to parallelize
+    if len(filter_files) == 1 or workers == 1:
+        results = map(collect_filter_rules, filter_files,
+                      itertools.repeat(cache_dir))
+        for source_domains, source_exceptions in results:
+            domains.update(source_domains)
+            exceptions.update(source_exceptions)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(collect_filter_rules, filter_files,
+                                   itertools.repeat(cache_dir))
+            for source_domains, source_exceptions in results:
+                domains.update(source_domains)
+                exceptions.update(source_exceptions)
+    return sorted(domains), sorted(exceptions)
+
+
+def main(filter_files: list, terraform_file: str, workers: int = None,
+         cache_dir: str = None, summary_file: str = None, collapse: bool = False,
+         output_options: dict = None):
     """
     The main function where all code is called from
 
     Args:
-    filter_file: The path to your filter file
+    filter_files: The paths or URLs of your filter files
     terraform_file: The path you want to output your Terraform code to
+    workers: The number of processes to parse filter files with
+    cache_dir: The directory to cache remote filter files in (Disabled if None)
+    summary_file: The path to write a JSON summary of the changes to
+    collapse: Drop subdomains covered by a parent domain or an exception
+    output_options: A dictionary of "shards", "shard_by" and "output_format"
+    along with "stream" to write rules as they are parsed
     """
     # Configure logging
     logging.basicConfig(level=logging.WARNING,
                         datefmt='%m/%d/%G %H:%M:%S', format='%(asctime)s %(message)s')
-    list_of_domains = parse_filter_list(filter_file)[0]
-    list_of_exceptions = parse_filter_list(filter_file)[1]
-    save_lists_to_terraform(terraform_file, list_of_domains, list_of_exceptions)
+    output_options = dict(output_options or {})
+    if output_options.pop("stream", False):
+        if collapse:
+            logging.warning("Unable to collapse redundant domains while streaming")
+        summary = stream_lists_to_terraform(terraform_file,
+                                            iter_filter_rules(filter_files, cache_dir),
+                                            **output_options)
+    else:
+        list_of_domains, list_of_exceptions = parse_filter_lists(filter_files, workers,
+                                                                 cache_dir)
+        if collapse:
+            original_count = len(list_of_domains)
+            list_of_domains = dns_functions.collapse_domains(list_of_domains,
+                                                             list_of_exceptions)
+            removed_count = original_count - len(list_of_domains)
+            print("Collapsed %s domains to %s (%.1f%% smaller)" % (
+                original_count, len(list_of_domains),
+                100 * removed_count / original_count if original_count else 0))
+        summary = save_lists_to_terraform(terraform_file, list_of_domains,
+                                          list_of_exceptions, **output_options)
+    if summary_file:
+        with open(summary_file, 'w') as summary_output:
+            json.dump(summary, summary_output, indent=2)
+
+
+def positive_int(value: str) -> int:
+    """
+    Parse a command line argument that has to be a whole number of at least 1
+
+    Args:
+    value: The argument as given
+
+    Returns:
+    number: The argument as an int
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
 
 
 if __name__ == '__main__':
@@ -143,16 +703,66 @@ if __name__ == '__main__':
         description='Convert a DNS filter list to a Terraform variable.')
     # Add arguments
     PARSER.add_argument(
-        '-a', '--filterList', type=str,
-        help="The path to your filter file", required=True
+        '-a', '--filterList', type=str, nargs='+',
+        help="The paths or URLs of your filter files", required=True
     )
     PARSER.add_argument(
         '-t', '--terraformFile', type=str, default="./list.tf",
         help="The path you want to output to", required=False
     )
+    PARSER.add_argument(
+        '-w', '--workers', type=int, default=None,
+        help="How many processes to parse filter files with", required=False
+    )
+    PARSER.add_argument(
+        '-c', '--cacheDir', type=str, default="/tmp/dns_filter_cache",
+        help="The directory to cache remote filter files in", required=False
+    )
+    PARSER.add_argument(
+        '-n', '--noCache', action='store_true',
+        help="Always download remote filter files in full", required=False
+    )
+    PARSER.add_argument(
+        '-s', '--summaryFile', type=str, default=None,
+        help="The path to write a JSON summary of added/removed domains to",
+        required=False
+    )
+    PARSER.add_argument(
+        '-r', '--collapseRedundant', action='store_true',
+        help="Drop subdomains already covered by a parent domain or an exception",
+        required=False
+    )
+    PARSER.add_argument(
+        '-S', '--shards', type=positive_int, default=1,
+        help="How many files to split the filter list across", required=False
+    )
+    PARSER.add_argument(
+        '-b', '--shardBy', type=str, default="hash", choices=["hash", "label"],
+        help="Shard by a hash of the domain or of its last two labels", required=False
+    )
+    PARSER.add_argument(
+        '-f', '--format', type=str, default="hcl", choices=["hcl", "json"],
+        help="Write HCL (.tf) or Terraform JSON (.tf.json)", required=False
+    )
+    PARSER.add_argument(
+        '-u', '--stream', action='store_true',
+        help="Write rules as they are parsed without sorting or deduplicating them",
+        required=False
+    )
     # Array for all arguments passed to script
     ARGS = PARSER.parse_args()
     # Assign args to variables
     ARG_FILTER_FILE = ARGS.filterList
     ARG_TF_FILE = ARGS.terraformFile
-    main(ARG_FILTER_FILE, ARG_TF_FILE)
+    ARG_WORKERS = ARGS.workers
+    ARG_CACHE_DIR = None if ARGS.noCache else ARGS.cacheDir
+    ARG_SUMMARY_FILE = ARGS.summaryFile
+    ARG_COLLAPSE = ARGS.collapseRedundant
+    ARG_OUTPUT_OPTIONS = {
+        "shards": ARGS.shards,
+        "shard_by": ARGS.shardBy,
+        "output_format": ARGS.format,
+        "stream": ARGS.stream
+    }
+    main(ARG_FILTER_FILE, ARG_TF_FILE, ARG_WORKERS, ARG_CACHE_DIR, ARG_SUMMARY_FILE,
+         ARG_COLLAPSE, ARG_OUTPUT_OPTIONS)
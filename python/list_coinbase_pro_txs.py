@@ -14,11 +14,332 @@
 #
 
 import argparse
+import csv
+import datetime
+import itertools
 import json
-import crypto_functions
+import queue
+import sqlite3
+import sys
+import threading
+from decimal import Decimal
+# crypto_functions pulls in requests so it is only imported once arguments are parsed
 
 
-def main(coinbase_creds_file, include_orders, hours):
+# The CoinbaseProClient record iterator methods keyed by the kind of record they return
+RECORD_ITERATORS = {
+    "transactions": "tx_iter",
+    "orders": "order_iter"
+}
+# The Coinbase Pro endpoint each kind of record can be fetched from by ID
+RECORD_ENDPOINTS = {
+    "transactions": "transfers",
+    "orders": "orders"
+}
+# SQL conditions that match stored records that can still change
+UNSETTLED_CONDITIONS = {
+    "transactions": "json_extract(data, '$.completed_at') IS NULL"
+                    " AND json_extract(data, '$.canceled_at') IS NULL",
+    "orders": "json_extract(data, '$.status') != 'done'"
+}
+
+
+def open_store(store_file):
+    """
+    Open the local SQLite transaction store, creating it if needed
+
+    Args:
+    store_file: The path to the SQLite file
+
+    Returns:
+    store: A sqlite3 connection
+    """
+    store = sqlite3.connect(store_file)
+    store.execute("CREATE TABLE IF NOT EXISTS records (kind TEXT, id TEXT,"
+                  " created_at REAL, data TEXT, PRIMARY KEY (kind, id))")
+    store.execute("CREATE INDEX IF NOT EXISTS records_by_time ON records (kind, created_at)")
+    store.execute("CREATE TABLE IF NOT EXISTS sync_state (kind TEXT PRIMARY KEY,"
+                  " newest_id TEXT, newest_time REAL, oldest_time REAL)")
+    store.commit()
+    return store
+
+
+def sync_window(store, kind, hours):
+    """
+    Work out how far back the next sync of a kind of record has to page
+
+    Args:
+    store: A sqlite3 connection from open_store
+    kind: Either "transactions" or "orders"
+    hours: How far back in hours you want to look
+
+    Returns:
+    window: A dictionary of "hours", "since" (A datetime to page back to or None to
+        page back X hours), "oldest_time", "newest_id" and "newest_time"
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cutoff = (now - datetime.timedelta(hours=hours)).timestamp()
+    state = store.execute("SELECT newest_id, newest_time, oldest_time FROM sync_state"
+                          " WHERE kind = ?", (kind,)).fetchone()
+    window = {"hours": hours, "since": None, "oldest_time": cutoff,
+              "newest_id": None, "newest_time": cutoff}
+    if state:
+        window["newest_id"], window["newest_time"] = state[0], state[1]
+    # Only fetch the delta if the store already covers the whole window
+    if state and state[2] <= cutoff:
+        window["since"] = datetime.datetime.fromtimestamp(state[1], datetime.timezone.utc)
+        window["oldest_time"] = state[2]
+    return window
+
+
+def fetch_records(cbpro_client, kind, window):
+    """
+    Stream every record a sync window needs from Coinbase Pro
+
+    Args:
+    cbpro_client: A crypto_functions.CoinbaseProClient
+    kind: Either "transactions" or "orders"
+    window: The window from sync_window
+
+    Returns:
+    records: An iterator of records as dictionaries
+    """
+    records = getattr(cbpro_client, RECORD_ITERATORS[kind])(window["hours"], window["since"])
+    if kind == "orders":
+        # Orders are only listed once they are done, so keep track of the open
+        # ones too in case they fill after this sync
+        records = itertools.chain(records, cbpro_client.paginate(
+            "orders", {"status": ["open", "pending", "active"]}, window["hours"],
+            window["since"]))
+    return records
+
+
+def sync_store(store, cbpro_client, kind, window, records=None):
+    """
+    Fetch only the records newer than the last sync in to the local store,
+    backfilling first if the store doesn't reach back X hours yet.
+    Records that were still pending or open are fetched again so they don't
+    stay frozen in the state they were first seen in
+
+    Args:
+    store: A sqlite3 connection from open_store
+    cbpro_client: A crypto_functions.CoinbaseProClient
+    kind: Either "transactions" or "orders"
+    window: The window from sync_window
+    records: The records from fetch_records if they are already being fetched
+
+    Returns:
+    new_records: How many records were added to the store
+    """
+    import crypto_functions  # pylint: disable=import-outside-toplevel
+    newest_id, newest_time = window["newest_id"], window["newest_time"]
+    # Records that can still change, fetched before the new ones are stored
+    unsettled_ids = [row[0] for row in store.execute(
+        "SELECT id FROM records WHERE kind = ? AND " + UNSETTLED_CONDITIONS[kind], (kind,))]
+    if records is None:
+        records = fetch_records(cbpro_client, kind, window)
+    new_records = 0
+    for record in records:
+        created_at = crypto_functions.parse_cbpro_time(record['created_at']).timestamp()
+        new_records += store_record(store, kind, record, created_at)
+        if created_at > newest_time:
+            newest_id, newest_time = record['id'], created_at
+    for record_id in unsettled_ids:
+        result = cbpro_client.get("%s/%s" % (RECORD_ENDPOINTS[kind], record_id))
+        if result.status_code == 404:
+            # Canceled orders are deleted by Coinbase Pro
+            store.execute("DELETE FROM records WHERE kind = ? AND id = ?", (kind, record_id))
+            continue
+        result.raise_for_status()
+        record = result.json()
+        store_record(store, kind, record,
+                     crypto_functions.parse_cbpro_time(record['created_at']).timestamp())
+    store.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)",
+                  (kind, newest_id, newest_time, window["oldest_time"]))
+    store.commit()
+    return new_records
+
+
+def store_record(store, kind, record, created_at):
+    """
+    Insert a record in to the local store or refresh the stored copy of it
+
+    Args:
+    store: A sqlite3 connection from open_store
+    kind: Either "transactions" or "orders"
+    record: The record as a dictionary
+    created_at: The UNIX timestamp the record was created at
+
+    Returns:
+    new_record: 1 if the record wasn't stored before, otherwise 0
+    """
+    new_record = store.execute("SELECT 1 FROM records WHERE kind = ? AND id = ?",
+                               (kind, record['id'])).fetchone() is None
+    store.execute("INSERT INTO records VALUES (?, ?, ?, ?) ON CONFLICT (kind, id)"
+                  " DO UPDATE SET created_at = excluded.created_at, data = excluded.data",
+                  (kind, record['id'], created_at, json.dumps(record)))
+    return int(new_record)
+
+
+def query_store(store, kind, hours):
+    """
+    Stream the records in the local store from the last X hours, newest first
+
+    Args:
+    store: A sqlite3 connection from open_store
+    kind: Either "transactions" or "orders"
+    hours: How far back in hours you want to look
+
+    Yields:
+    record: A single record as a dictionary
+    """
+    cutoff = (datetime.datetime.now(datetime.timezone.utc)
+              - datetime.timedelta(hours=hours)).timestamp()
+    # Open orders are only kept so they can be refreshed once they are done
+    status_condition = " AND json_extract(data, '$.status') = 'done'" if kind == "orders" else ""
+    for row in store.execute("SELECT data FROM records WHERE kind = ? AND created_at >= ?"
+                             + status_condition + " ORDER BY created_at DESC", (kind, cutoff)):
+        yield json.loads(row[0])
+
+
+def print_status(message, output_format):
+    """
+    Print a status message where it won't corrupt machine readable output
+
+    Args:
+    message: The message to print
+    output_format: One of "json", "ndjson" or "csv"
+    """
+    if output_format == "json":
+        print(message)
+    else:
+        print(message, file=sys.stderr)
+
+
+def print_records(records, output_format):
+    """
+    Print records one at a time as they arrive so memory use stays constant
+
+    Args:
+    records: An iterable of dictionaries
+    output_format: One of "json", "ndjson" or "csv"
+    """
+    if output_format == "csv":
+        writer = None
+        for record in records:
+            if writer is None:
+                # The first record decides the columns
+                writer = csv.DictWriter(sys.stdout, fieldnames=list(record),
+                                        extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow(record)
+    elif output_format == "ndjson":
+        for record in records:
+            print(json.dumps(record))
+    else:
+        separator = "[\n"
+        for record in records:
+            sys.stdout.write(separator + "  " + json.dumps(record, indent=2).replace("\n", "\n  "))
+            separator = ",\n"
+        print("\n]")
+
+
+def print_section(records, name, hours, output_format):
+    """
+    Print a heading and the records of a section, or a message if it is empty
+
+    Args:
+    records: An iterable of dictionaries
+    name: The name of the records such as "transactions"
+    hours: How far back in hours you looked
+    output_format: One of "json", "ndjson" or "csv"
+    """
+    first_record = next(records, None)
+    if first_record is None:
+        print_status("No %s found in the last %s hours" % (name, hours), output_format)
+    else:
+        print_status("%s in the last %s hours" % (name.capitalize(), hours), output_format)
+        print_records(itertools.chain([first_record], records), output_format)
+
+
+def total_orders(orders, product_totals):
+    """
+    Add the total cost to each order as it streams past and tally
+    per product totals using Decimal so no cents are lost to floats
+
+    Args:
+    orders: An iterable of Coinbase Pro orders as dictionaries
+    product_totals: A dictionary to tally each product's totals in to
+
+    Yields:
+    order: The order with a total_cost field
+    """
+    for order in orders:
+        fill_fees = Decimal(order['fill_fees'])
+        executed_value = Decimal(order['executed_value'])
+        order['total_cost'] = str(fill_fees + executed_value)
+        totals = product_totals.setdefault(order['product_id'], {
+            "orders": 0, "executed_value": Decimal(0), "fill_fees": Decimal(0)
+        })
+        totals["orders"] += 1
+        totals["executed_value"] += executed_value
+        totals["fill_fees"] += fill_fees
+        yield order
+
+
+def print_order_summary(product_totals, output_format):
+    """
+    Print the per product order totals
+
+    Args:
+    product_totals: A dictionary of product totals from total_orders
+    output_format: One of "json", "ndjson" or "csv"
+    """
+    for product, totals in sorted(product_totals.items()):
+        print_status("%s: %s orders, executed value %s, fees %s, total cost %s" % (
+            product, totals["orders"], totals["executed_value"], totals["fill_fees"],
+            totals["executed_value"] + totals["fill_fees"]), output_format)
+
+
+def prefetch(records, max_buffered=1000):
+    """
+    Start consuming an iterator in a background thread so its requests
+    run while the caller is busy with something else
+
+    Args:
+    records: An iterable to consume
+    max_buffered: The most records to hold before the background thread waits
+
+    Returns:
+    records: A generator of each record from the iterable in order
+    """
+    buffer = queue.Queue(maxsize=max_buffered)
+    finished = object()
+
+    def fill_buffer():
+        try:
+            for record in records:
+                buffer.put(record)
+        except Exception as err:  # pylint: disable=broad-except
+            buffer.put(err)
+        buffer.put(finished)
+
+    def drain_buffer():
+        while True:
+            record = buffer.get()
+            if record is finished:
+                return
+            if isinstance(record, Exception):
+                raise record
+            yield record
+
+    # Start right away rather than when the first record is asked for
+    threading.Thread(target=fill_buffer, daemon=True).start()
+    return drain_buffer()
+
+
+def main(coinbase_creds_file, include_orders, hours, output_format="json", store_file=None,
+         summary_only=False):
     """
     The main function where all code is called from
 
@@ -26,27 +347,41 @@ def main(coinbase_creds_file, include_orders, hours):
     coinbase_creds_file: The path to your Coinbase coinbase_pro.json file
     include_orders: If true, include orders
     hours: How far back in hours you want to look
+    output_format: One of "json", "ndjson" or "csv"
+    store_file: An optional SQLite file to keep a local copy of records in
+    summary_only: If true, only print the per product order totals
     """
+    import crypto_functions  # pylint: disable=import-outside-toplevel
     cbpro_creds = crypto_functions.get_cbpro_creds_from_file(coinbase_creds_file)
-    # Get transactions for printing
-    tx_result = crypto_functions.cbpro_tx_grab(cbpro_creds[0], cbpro_creds[1], cbpro_creds[2], hours)
-    transactions = json.dumps(tx_result.json(), indent=2)
-    if transactions == "[]":
-        print("No transactions found in the last %s hours" % hours)
+    cbpro_client = crypto_functions.CoinbaseProClient(cbpro_creds[0], cbpro_creds[1],
+                                                      cbpro_creds[2])
+    kinds = ["transactions", "orders"] if include_orders else ["transactions"]
+    if store_file:
+        store = open_store(store_file)
+        # Fetch every kind at once but write them all through this one connection
+        windows = {kind: sync_window(store, kind, hours) for kind in kinds}
+        fetches = {kind: prefetch(fetch_records(cbpro_client, kind, windows[kind]))
+                   for kind in kinds}
+        for kind in kinds:
+            new_records = sync_store(store, cbpro_client, kind, windows[kind], fetches[kind])
+            print_status("Synced %s new %s" % (new_records, kind), output_format)
+        records = {kind: query_store(store, kind, hours) for kind in kinds}
     else:
-        print("Transactions in the last %s hours" % hours)
-        print(transactions)
+        # Fetch every kind at once while the first is being printed
+        records = {kind: prefetch(getattr(cbpro_client, RECORD_ITERATORS[kind])(hours))
+                   for kind in kinds}
+    print_section(records["transactions"], "transactions", hours, output_format)
     if include_orders:
-        order_result = crypto_functions.cbpro_order_grab(cbpro_creds[0], cbpro_creds[1], cbpro_creds[2], hours)
-        orders = json.dumps(order_result.json(), indent=2)
-        if orders == "[]":
-            print("No orders found in the last %s hours" % hours)
+        product_totals = {}
+        orders = total_orders(records["orders"], product_totals)
+        if summary_only:
+            for _ in orders:
+                pass
         else:
-            print("Orders in the last %s hours" % hours)
-            for order in json.loads(orders):
-                print(json.dumps(order, indent=2))
-                total_cost = float(order['fill_fees']) + float(order['executed_value'])
-                print("Total cost of order: %s" % total_cost)
+            print_section(orders, "orders", hours, output_format)
+        print_order_summary(product_totals, output_format)
+    if store_file:
+        store.close()
 
 
 if __name__ == '__main__':
@@ -68,10 +403,27 @@ if __name__ == '__main__':
         '-hr', '--hours', type=int,
         help="How many hours back do you want to look?", required=True
     )
+    PARSER.add_argument(
+        '-f', '--format', type=str, default="json", choices=["json", "ndjson", "csv"],
+        help="How to print the records", required=False
+    )
+    PARSER.add_argument(
+        '-d', '--storeFile', type=str, default=None,
+        help="A SQLite file to keep a local copy of records in and only sync new ones",
+        required=False
+    )
+    PARSER.add_argument(
+        '-s', '--summaryOnly', action='store_true',
+        help="Only print per product order totals instead of every order", required=False
+    )
     # Array for all arguments passed to script
     ARGS = PARSER.parse_args()
     # Assign args to variables
     ARG_COINBASE_CREDS = ARGS.coinbaseCredsFile
     ARG_ORDERS = ARGS.orders
     ARG_HOURS = ARGS.hours
-    main(ARG_COINBASE_CREDS, ARG_ORDERS, ARG_HOURS)
+    ARG_FORMAT = ARGS.format
+    ARG_STORE_FILE = ARGS.storeFile
+    ARG_SUMMARY_ONLY = ARGS.summaryOnly
+    main(ARG_COINBASE_CREDS, ARG_ORDERS, ARG_HOURS, ARG_FORMAT, ARG_STORE_FILE,
+         ARG_SUMMARY_ONLY)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""A fast way to value a portfolio of crypto holdings and work out its
+ profit/loss and allocation"""
+#
+# Python Script:: portfolio.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import operator
+import sys
+from array import array
+# crypto_functions pulls in requests so it is only imported once there are holdings to price
+
+
+# The columns printed for each symbol in the portfolio
+SUMMARY_COLUMNS = ["symbol", "quantity", "price", "value", "cost_basis", "profit_loss",
+                   "profit_loss_percent", "allocation_percent"]
+
+
+def load_holdings(holdings_file):
+    """
+    Load holdings from a CSV file with symbol, quantity and cost_basis columns
+    into columns of arrays so they can be valued without a Python loop per row
+
+    Args:
+    holdings_file: The path to the holdings CSV (cost_basis is the total paid for the position)
+
+    Returns:
+    holdings: A dictionary of "symbols" (a list), "quantities" and "cost_bases" (arrays of doubles)
+        and "positions" (each symbol's row indices, grouped while the file is read)
+    """
+    holdings = {"symbols": [], "quantities": array("d"), "cost_bases": array("d"),
+                "positions": {}}
+    with open(holdings_file, newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            symbol = row["symbol"].strip()
+            holdings["positions"].setdefault(symbol, []).append(len(holdings["symbols"]))
+            holdings["symbols"].append(symbol)
+            holdings["quantities"].append(float(row["quantity"]))
+            holdings["cost_bases"].append(float(row.get("cost_basis") or 0))
+    return holdings
+
+
+def value_holdings(holdings, coin_prices):
+    """
+    Work out the price, value, profit/loss and allocation of every position.
+    Each column is computed in a single map over the arrays
+
+    Args:
+    holdings: A dictionary of holdings from load_holdings
+    coin_prices: A dictionary of each symbol and its current price
+
+    Returns:
+    valuation: A dictionary of "prices", "values", "profit_loss" and "allocation" arrays
+        in the same order as the holdings, plus "total_value", "total_cost_basis",
+        "total_profit_loss" and the "unpriced" symbols (Valued at 0)
+    """
+    symbols = holdings["symbols"]
+    unpriced = sorted(set(symbols).difference(coin_prices))
+    prices = array("d", map(coin_prices.get, symbols, itertools.repeat(0.0)))
+    values = array("d", map(operator.mul, holdings["quantities"], prices))
+    profit_loss = array("d", map(operator.sub, values, holdings["cost_bases"]))
+    total_value = math.fsum(values)
+    scale = 100 / total_value if total_value else 0
+    allocation = array("d", map(scale.__mul__, values))
+    total_cost_basis = math.fsum(holdings["cost_bases"])
+    return {
+        "prices": prices,
+        "values": values,
+        "profit_loss": profit_loss,
+        "allocation": allocation,
+        "total_value": total_value,
+        "total_cost_basis": total_cost_basis,
+        "total_profit_loss": total_value - total_cost_basis,
+        "unpriced": unpriced
+    }
+
+
+def summarize_by_symbol(holdings, valuation):
+    """
+    Roll every position up into one row per symbol.
+    Each symbol's positions are gathered in one go from the row indices
+    load_holdings grouped them by, and as they share a price only their
+    quantities and cost bases need summing
+
+    Args:
+    holdings: A dictionary of holdings from load_holdings
+    valuation: The valuation of the holdings from value_holdings
+
+    Returns:
+    summary: A list of dictionaries with SUMMARY_COLUMNS, largest value first
+    """
+    summary = []
+    for symbol, positions in holdings["positions"].items():
+        # The extra first index keeps itemgetter returning a tuple for a single position
+        gather = operator.itemgetter(positions[0], *positions)
+        quantity = math.fsum(gather(holdings["quantities"])[1:])
+        cost_basis = math.fsum(gather(holdings["cost_bases"])[1:])
+        price = valuation["prices"][positions[0]]
+        value = quantity * price
+        summary.append({
+            "symbol": symbol,
+            "quantity": quantity,
+            "price": price,
+            "value": value,
+            "cost_basis": cost_basis,
+            "profit_loss": value - cost_basis,
+            "profit_loss_percent": (value - cost_basis) / cost_basis * 100 if cost_basis else None,
+            "allocation_percent": (value / valuation["total_value"] * 100
+                                   if valuation["total_value"] else 0)
+        })
+    summary.sort(key=operator.itemgetter("value"), reverse=True)
+    return summary
+
+
+def main(holdings_file, cmc_api_key, coinbase_creds_file, price_cache_file=None,
+         output_format="csv"):
+    """
+    The main function where all code is called from
+
+    Args:
+    holdings_file: The path to the holdings CSV
+    cmc_api_key: The CoinMarketCap API key
+    coinbase_creds_file: The path to your Coinbase coinbase.json
+    price_cache_file: An optional SQLite file to share recent prices between runs
+    output_format: Either "csv" or "json"
+    """
+    import crypto_functions  # pylint: disable=import-outside-toplevel
+    holdings = load_holdings(holdings_file)
+    coinbase_creds = crypto_functions.get_coinbase_creds_from_file(coinbase_creds_file)
+    coinbase_client = crypto_functions.CoinbaseClient(coinbase_creds[0], coinbase_creds[1])
+    price_cache = crypto_functions.PriceCache(db_path=price_cache_file)
+    coin_prices = crypto_functions.resolve_prices(cmc_api_key, coinbase_client,
+                                                  holdings["symbols"], price_cache)
+    valuation = value_holdings(holdings, coin_prices)
+    summary = summarize_by_symbol(holdings, valuation)
+    totals = {
+        "total_value": valuation["total_value"],
+        "total_cost_basis": valuation["total_cost_basis"],
+        "total_profit_loss": valuation["total_profit_loss"],
+        "unpriced": valuation["unpriced"]
+    }
+    if output_format == "json":
+        print(json.dumps({"symbols": summary, **totals}, indent=2))
+        return
+    writer = csv.DictWriter(sys.stdout, fieldnames=SUMMARY_COLUMNS)
+    writer.writeheader()
+    writer.writerows(summary)
+    print("Total value %.2f, cost basis %.2f, profit/loss %.2f" % (
+        totals["total_value"], totals["total_cost_basis"], totals["total_profit_loss"]),
+        file=sys.stderr)
+    if totals["unpriced"]:
+        print("No price found for: %s" % ", ".join(totals["unpriced"]), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    # This function parses and return arguments passed in
+    # Assign description to the help doc
+    PARSER = argparse.ArgumentParser(
+        description='A fast way to value a portfolio of crypto holdings'
+                    ' and work out its profit/loss and allocation.')
+    # Add arguments
+    PARSER.add_argument(
+        '-H', '--holdingsFile', type=str,
+        help="A CSV file with symbol, quantity and cost_basis columns", required=True
+    )
+    PARSER.add_argument(
+        '-m', '--coinMarketCapApiKey', type=str,
+        help="Your CoinMarketCap API Key", required=True
+    )
+    PARSER.add_argument(
+        '-c', '--coinbaseCredsFile', type=str,
+        help="The path to your Coinbase coinbase.json file", required=True
+    )
+    PARSER.add_argument(
+        '-p', '--priceCacheFile', type=str, default=None,
+        help="A SQLite file to share recent prices between runs", required=False
+    )
+    PARSER.add_argument(
+        '-f', '--format', type=str, default="csv", choices=["csv", "json"],
+        help="How to print the portfolio", required=False
+    )
+    # Array for all arguments passed to script
+    ARGS = PARSER.parse_args()
+    # Assign args to variables
+    ARG_HOLDINGS_FILE = ARGS.holdingsFile
+    ARG_CMC_API_KEY = ARGS.coinMarketCapApiKey
+    ARG_COINBASE_CREDS = ARGS.coinbaseCredsFile
+    ARG_PRICE_CACHE_FILE = ARGS.priceCacheFile
+    ARG_FORMAT = ARGS.format
+    main(ARG_HOLDINGS_FILE, ARG_CMC_API_KEY, ARG_COINBASE_CREDS, ARG_PRICE_CACHE_FILE,
+         ARG_FORMAT)
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""A compact on disk price history with OHLC, moving average and
+ percent change queries"""
+#
+# Python Script:: price_history.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+
+import argparse
+import bisect
+import collections
+import contextlib
+import csv
+import datetime
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+
+
+# Every sample is a little-endian float64 UNIX timestamp followed by a float64 price
+SAMPLE_FORMAT = struct.Struct("<dd")
+# The file extension of a symbol's series
+SERIES_EXTENSION = ".f64"
+# Characters that are not safe in a series file name
+UNSAFE_SYMBOL_REGEX = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def series_path(history_dir, symbol):
+    """
+    Get the path of the file that holds a symbol's price series
+
+    Args:
+    history_dir: The directory that holds every series
+    symbol: The symbol of the coin
+
+    Returns:
+    path: The path to the symbol's series file
+    """
+    return os.path.join(history_dir, UNSAFE_SYMBOL_REGEX.sub("_", symbol) + SERIES_EXTENSION)
+
+
+def list_symbols(history_dir):
+    """
+    List every symbol that has a series in a history directory
+
+    Args:
+    history_dir: The directory that holds every series
+
+    Returns:
+    symbols: A sorted list of symbols
+    """
+    if not os.path.isdir(history_dir):
+        return []
+    return sorted(file_name[:-len(SERIES_EXTENSION)] for file_name in os.listdir(history_dir)
+                  if file_name.endswith(SERIES_EXTENSION))
+
+
+def append_prices(history_dir, timestamp, prices):
+    """
+    Append one sample per symbol to the end of each symbol's series.
+    Samples that are not newer than the last recorded one are skipped so
+    every series stays sorted by time
+
+    Args:
+    history_dir: The directory that holds every series
+    timestamp: The UNIX timestamp of the prices
+    prices: A dictionary of symbols and prices
+
+    Returns:
+    appended: How many samples were written
+    """
+    os.makedirs(history_dir, exist_ok=True)
+    appended = 0
+    for symbol, price in prices.items():
+        with open(series_path(history_dir, symbol), "a+b") as series_file:
+            size = series_file.seek(0, os.SEEK_END)
+            # Drop a partial sample left behind by an interrupted write
+            if size % SAMPLE_FORMAT.size:
+                size -= size % SAMPLE_FORMAT.size
+                series_file.truncate(size)
+            if size:
+                series_file.seek(size - SAMPLE_FORMAT.size)
+                last_timestamp = SAMPLE_FORMAT.unpack(series_file.read(SAMPLE_FORMAT.size))[0]
+                if timestamp <= last_timestamp:
+                    continue
+            series_file.write(SAMPLE_FORMAT.pack(timestamp, float(price)))
+            appended += 1
+    return appended
+
+
+@contextlib.contextmanager
+def open_series(history_dir, symbol):
+    """
+    Memory-map a symbol's series so it can be searched without reading it in
+
+    Args:
+    history_dir: The directory that holds every series
+    symbol: The symbol of the coin
+
+    Returns:
+    timestamps: A read-only sequence of every sample's timestamp
+    prices: A read-only sequence of every sample's price
+    """
+    path = series_path(history_dir, symbol)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    size -= size % SAMPLE_FORMAT.size
+    if not size:
+        yield (), ()
+        return
+    with open(path, "rb") as series_file, \
+            mmap.mmap(series_file.fileno(), size, access=mmap.ACCESS_READ) as series_map:
+        samples = memoryview(series_map).cast("d")
+        timestamps, prices = samples[0::2], samples[1::2]
+        try:
+            yield timestamps, prices
+        finally:
+            # The map can't be closed while a view of it is still held
+            timestamps.release()
+            prices.release()
+            samples.release()
+
+
+def read_series(history_dir, symbol, start=None, end=None):
+    """
+    Yield the samples of a symbol's series between two times.
+    The range is found with a binary search so only the samples in it are read
+
+    Args:
+    history_dir: The directory that holds every series
+    symbol: The symbol of the coin
+    start: The earliest UNIX timestamp to include (From the first sample if None)
+    end: The UNIX timestamp to stop before (Until the last sample if None)
+
+    Returns:
+    samples: A generator of (timestamp, price) tuples in time order
+    """
+    with open_series(history_dir, symbol) as (timestamps, prices):
+        first = 0 if start is None else bisect.bisect_left(timestamps, start)
+        last = len(timestamps) if end is None else bisect.bisect_left(timestamps, end)
+        for index in range(first, last):
+            yield timestamps[index], prices[index]
+
+
+def ohlc(samples, interval):
+    """
+    Group samples into fixed intervals and yield the open, high, low and
+    close price of each one
+
+    Args:
+    samples: An iterable of (timestamp, price) tuples in time order
+    interval: The length of each interval in seconds
+
+    Returns:
+    candles: A generator of (interval_start, open, high, low, close) tuples
+    """
+    candle = []
+    for timestamp, price in samples:
+        bucket = timestamp - timestamp % interval
+        if candle and candle[0] == bucket:
+            candle[2] = max(candle[2], price)
+            candle[3] = min(candle[3], price)
+            candle[4] = price
+            continue
+        if candle:
+            yield tuple(candle)
+        candle = [bucket, price, price, price, price]
+    if candle:
+        yield tuple(candle)
+
+
+def moving_average(samples, window):
+    """
+    Yield the average price over a trailing time window at every sample
+
+    Args:
+    samples: An iterable of (timestamp, price) tuples in time order
+    window: The length of the trailing window in seconds
+
+    Returns:
+    averages: A generator of (timestamp, average_price) tuples
+    """
+    in_window = collections.deque()
+    window_total = 0.0
+    for timestamp, price in samples:
+        in_window.append((timestamp, price))
+        window_total += price
+        while in_window[0][0] <= timestamp - window:
+            window_total -= in_window.popleft()[1]
+        yield timestamp, window_total / len(in_window)
+
+
+def percent_change(samples):
+    """
+    Work out how much the price changed from the first to the last sample
+
+    Args:
+    samples: An iterable of (timestamp, price) tuples in time order
+
+    Returns:
+    change: A (first_timestamp, last_timestamp, percent_change) tuple
+        or None if there are no samples
+    """
+    first = last = None
+    for sample in samples:
+        if first is None:
+            first = sample
+        last = sample
+    if first is None:
+        return None
+    if not first[1]:
+        return first[0], last[0], None
+    return first[0], last[0], (last[1] - first[1]) / first[1] * 100
+
+
+def parse_time(value):
+    """
+    Parse an ISO-8601 date or time into a UNIX timestamp, treating naive times as UTC
+
+    Args:
+    value: An ISO-8601 string such as 2022-01-31 or 2022-01-31T12:00:00
+
+    Returns:
+    timestamp: The UNIX timestamp or None if value is empty
+    """
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def format_time(timestamp):
+    """
+    Format a UNIX timestamp as an ISO-8601 UTC time
+
+    Args:
+    timestamp: The UNIX timestamp
+
+    Returns:
+    time: The ISO-8601 string
+    """
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+# The columns each query exports
+QUERY_COLUMNS = {
+    "raw": ["time", "price"],
+    "ohlc": ["time", "open", "high", "low", "close"],
+    "sma": ["time", "average"],
+    "change": ["start", "end", "percent_change"]
+}
+
+
+def run_query(history_dir, symbol, query, start=None, end=None, interval=3600, window=86400):
+    """
+    Run a query against a symbol's series
+
+    Args:
+    history_dir: The directory that holds every series
+    symbol: The symbol of the coin
+    query: One of "raw", "ohlc", "sma" or "change"
+    start: The earliest UNIX timestamp to include
+    end: The UNIX timestamp to stop before
+    interval: The OHLC interval in seconds
+    window: The moving average window in seconds
+
+    Returns:
+    rows: A generator of result tuples matching QUERY_COLUMNS[query]
+    """
+    samples = read_series(history_dir, symbol, start, end)
+    if query == "ohlc":
+        rows = ohlc(samples, interval)
+    elif query == "sma":
+        rows = moving_average(samples, window)
+    elif query == "change":
+        change = percent_change(samples)
+        rows = [] if change is None else [change]
+    else:
+        rows = samples
+    for row in rows:
+        # Every query leads with a timestamp and "change" has two
+        timestamp_columns = 2 if query == "change" else 1
+        yield tuple(format_time(value) for value in row[:timestamp_columns]) + \
+            tuple(row[timestamp_columns:])
+
+
+def main(history_dir, symbols, query, start=None, end=None, interval=3600, window=86400,
+         output_format="csv"):
+    """
+    The main function where all code is called from
+
+    Args:
+    history_dir: The directory that holds every series
+    symbols: A list of symbols to export (Every symbol in history_dir if empty)
+    query: One of "raw", "ohlc", "sma" or "change"
+    start: The earliest ISO-8601 time to include
+    end: The ISO-8601 time to stop before
+    interval: The OHLC interval in seconds
+    window: The moving average window in seconds
+    output_format: Either "csv" or "ndjson"
+    """
+    columns = ["symbol"] + QUERY_COLUMNS[query]
+    writer = csv.writer(sys.stdout) if output_format == "csv" else None
+    if writer:
+        writer.writerow(columns)
+    for symbol in symbols or list_symbols(history_dir):
+        for row in run_query(history_dir, symbol, query, parse_time(start), parse_time(end),
+                             interval, window):
+            if writer:
+                writer.writerow((symbol,) + row)
+            else:
+                print(json.dumps(dict(zip(columns, (symbol,) + row))))
+
+
+def positive_int(value):
+    """
+    Parse a command line argument that has to be a whole number of at least 1
+
+    Args:
+    value: The argument as given
+
+    Returns:
+    number: The argument as an int
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("%s is not a positive number" % value)
+    return number
+
+
+if __name__ == '__main__':
+    # This function parses and return arguments passed in
+    # Assign description to the help doc
+    PARSER = argparse.ArgumentParser(
+        description='Export OHLC, moving average and percent change queries'
+                    ' from the price history crypto_pricing.py records.')
+    # Add arguments
+    PARSER.add_argument(
+        '-d', '--historyDir', type=str,
+        help="The directory crypto_pricing.py records price history in", required=True
+    )
+    PARSER.add_argument(
+        '-s', '--symbols', type=str, nargs='+', default=[],
+        help="The symbols to export (Every recorded symbol by default)", required=False
+    )
+    PARSER.add_argument(
+        '-q', '--query', type=str, default="ohlc", choices=list(QUERY_COLUMNS),
+        help="The query to run", required=False
+    )
+    PARSER.add_argument(
+        '-b', '--start', type=str, default=None,
+        help="The earliest ISO-8601 time to include (UTC unless an offset is given)",
+        required=False
+    )
+    PARSER.add_argument(
+        '-e', '--end', type=str, default=None,
+        help="The ISO-8601 time to stop before (UTC unless an offset is given)",
+        required=False
+    )
+    PARSER.add_argument(
+        '-i', '--interval', type=positive_int, default=3600,
+        help="The OHLC interval in seconds", required=False
+    )
+    PARSER.add_argument(
+        '-w', '--window', type=positive_int, default=86400,
+        help="The moving average window in seconds", required=False
+    )
+    PARSER.add_argument(
+        '-f', '--format', type=str, default="csv", choices=["csv", "ndjson"],
+        help="How to print the results", required=False
+    )
+    # Array for all arguments passed to script
+    ARGS = PARSER.parse_args()
+    # Assign args to variables
+    ARG_HISTORY_DIR = ARGS.historyDir
+    ARG_SYMBOLS = ARGS.symbols
+    ARG_QUERY = ARGS.query
+    ARG_START = ARGS.start
+    ARG_END = ARGS.end
+    ARG_INTERVAL = ARGS.interval
+    ARG_WINDOW = ARGS.window
+    ARG_FORMAT = ARGS.format
+    main(ARG_HISTORY_DIR, ARG_SYMBOLS, ARG_QUERY, ARG_START, ARG_END, ARG_INTERVAL,
+         ARG_WINDOW, ARG_FORMAT)
@@ -16,37 +16,58 @@
 #
 
 import argparse
+import codecs
+import collections
+import email.utils
+import functools
+import hashlib
+import json
+import os
+import queue
 import re
-import sys
 import smtplib
-import email.utils
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from bs4 import BeautifulSoup
-import requests
+from html.parser import HTMLParser
+# requests, bs4 and lxml are slow to import so they are only imported where they are used,
+# keeping them out of --help
 
 
-# Email sending function
-def send_email(email_address, ses_access_key, ses_secret_key, body):
-    """A function to send email via AWS SES
+# The breeds to search for when none are given
+DEFAULT_TERMS = ["PUG"]
+# How many sheets to download at once
+DEFAULT_WORKERS = 8
+# How many bytes of a page to download and scan at a time when streaming
+STREAM_CHUNK_SIZE = 65536
+# Where and who results are emailed from
+SES_SMTP_HOST = "email-smtp.us-east-1.amazonaws.com"
+SES_SMTP_PORT = 587
+SENDER_EMAIL = "pug-finder@route1337.com"
+SENDER_NAME = "Pug Finder"
+EMAIL_SUBJECT = "Pug Finder Results"
+
+
+def build_email(email_address, body):
+    """A function to build a Pug Finder results email
 
     Args:
         email_address: An email address to send the results to
-        ses_access_key: An AWS SES Access Key
-        ses_secret_key: An AWS SES Secret Key
         body: The message body
-    """
-    # hard-coded variables
-    sender_email = "pug-finder@route1337.com"
-    sender_name = "Pug Finder"
-    subject = "Pug Finder Results"
 
+    Returns:
+        message: The message as a string ready for sendmail
+    """
     # Begin code using example from
     # https://docs.aws.amazon.com/ses/latest/DeveloperGuide/examples-send-using-smtp.html #
     # Create message container - the correct MIME type is multipart/alternative.
     msg = MIMEMultipart('alternative')
-    msg['Subject'] = subject
-    msg['From'] = email.utils.formataddr((sender_name, sender_email))
+    msg['Subject'] = EMAIL_SUBJECT
+    msg['From'] = email.utils.formataddr((SENDER_NAME, SENDER_EMAIL))
     msg['To'] = email_address
     # Record the MIME types of both parts - text/plain and text/html.
     part1 = MIMEText(body, 'plain')
@@ -54,50 +75,499 @@ def send_email(email_address, ses_access_key, ses_secret_key, body):
     # According to RFC 2046, the last part of a multipart message, in this case
     # the HTML message, is best and preferred.
     msg.attach(part1)
-    # Try to send the message.
-    try:
-        server = smtplib.SMTP("email-smtp.us-east-1.amazonaws.com", "587")
-        server.ehlo()
-        server.starttls()
-        # stmplib docs recommend calling ehlo() before & after starttls()
+    # End example code #
+    return msg.as_string()
+
+
+class EmailNotifier:
+    """Send emails from a background thread over one SMTP connection that is
+    kept logged in between messages and re-opened if the server drops it.
+    In digest mode every message queued for a recipient until close (or within
+    digest_window seconds if one is given) is merged into a single email
+    """
+    def __init__(self, ses_access_key, ses_secret_key, digest=False, digest_window=None,
+                 batch_size=50, smtp_host=SES_SMTP_HOST, smtp_port=SES_SMTP_PORT,
+                 use_tls=True, max_retries=3):
+        self.ses_access_key = ses_access_key
+        self.ses_secret_key = ses_secret_key
+        self.digest = digest
+        self.digest_window = digest_window
+        self.batch_size = batch_size
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
+        self.use_tls = use_tls
+        self.max_retries = max_retries
+        self.server = None
+        self.sent = 0
+        self.failed = 0
+        self.messages = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, email_address, body):
+        """Queue an email to be sent by the background thread
+        Args:
+            email_address: An email address to send the message to
+            body: The message body
+        """
+        self.messages.put((email_address, body))
+
+    def close(self):
+        """Send everything that is still queued and log out of the SMTP server"""
+        self.messages.put(None)
+        self.worker.join()
+
+    def _connect(self):
+        """Open and log in to an SMTP connection"""
+        server = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=60)
         server.ehlo()
-        server.login(ses_access_key, ses_secret_key)
-        server.sendmail(sender_email, email_address, msg.as_string())
-        server.close()
-    # Display an error message if something goes wrong.
-    except Exception as err:
-        print("Error: ", err)
+        if self.use_tls:
+            server.starttls()
+            # stmplib docs recommend calling ehlo() before & after starttls()
+            server.ehlo()
+        if self.ses_access_key:
+            server.login(self.ses_access_key, self.ses_secret_key)
+        self.server = server
+
+    def _disconnect(self):
+        """Close the SMTP connection, ignoring a connection that is already gone"""
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except OSError:
+            self.server.close()
+        self.server = None
+
+    def _next_batch(self):
+        """Wait for the next batch of queued messages
+        Returns:
+            batch: A list of (email_address, body) tuples
+            stop: True if close was called
+        """
+        batch = []
+        item = self.messages.get()
+        deadline = None if self.digest_window is None else time.monotonic() + self.digest_window
+        while item is not None:
+            batch.append(item)
+            # A digest is never cut at batch_size or it would go out as several emails
+            if not self.digest and len(batch) >= self.batch_size:
+                return batch, False
+            try:
+                if not self.digest:
+                    item = self.messages.get_nowait()
+                elif deadline is None:
+                    item = self.messages.get()
+                else:
+                    item = self.messages.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def _deliver(self, email_address, body):
+        """Send a single email, reconnecting and retrying if the connection fails
+        Args:
+            email_address: An email address to send the message to
+            body: The message body
+        """
+        message = build_email(email_address, body)
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.server is None:
+                    self._connect()
+                self.server.sendmail(SENDER_EMAIL, email_address, message)
+            except smtplib.SMTPRecipientsRefused as err:
+                # The server rejected the recipient so sending it again won't help
+                print("Error: ", err)
+                break
+            except OSError as err:
+                print("Error: ", err)
+                # Neither will sending again after any other permanent (5xx) error
+                if getattr(err, "smtp_code", 0) >= 500:
+                    break
+                self._disconnect()
+                if attempt < self.max_retries:
+                    time.sleep(min(30, 2 ** attempt))
+                continue
+            self.sent += 1
+            print("Email sent!")
+            return
+        self.failed += 1
+
+    def _run(self):
+        """Send queued messages in batches until close is called"""
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if self.digest:
+                # Merge every message for the same recipient into one email
+                digests = {}
+                for email_address, body in batch:
+                    digests.setdefault(email_address, []).append(body)
+                batch = [(email_address, "\n".join(bodies))
+                         for email_address, bodies in digests.items()]
+            for email_address, body in batch:
+                self._deliver(email_address, body)
+        self._disconnect()
+
+
+# Email sending function
+def send_email(email_address, ses_access_key, ses_secret_key, body):
+    """A function to send email via AWS SES
+
+    Args:
+        email_address: An email address to send the results to
+        ses_access_key: An AWS SES Access Key
+        ses_secret_key: An AWS SES Secret Key
+        body: The message body
+    """
+    with EmailNotifier(ses_access_key, ses_secret_key) as notifier:
+        notifier.send(email_address, body)
+
+
+@functools.lru_cache(maxsize=None)
+def get_http_session(pool_maxsize=DEFAULT_WORKERS):
+    """A function to get a keep-alive HTTP session shared by every sheet fetch
+
+    Args:
+        pool_maxsize: How many connections to keep open per host
+
+    Returns:
+        session: A requests Session
+    """
+    import requests  # pylint: disable=import-outside-toplevel
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def build_search_pattern(search_terms):
+    """A function to combine every search term into one pattern so a
+    page's text only has to be scanned once
+
+    Args:
+        search_terms: A list of strings to search for
+
+    Returns:
+        pattern: A compiled regex that captures a term at every position it starts
+        covered_terms: A dictionary of each term and every term found inside it
+    """
+    search_terms = sorted(set(search_terms), key=len, reverse=True)
+    # A lookahead tries every position and the longest term wins at each one,
+    # so shorter terms that start in the same place are credited via covered_terms
+    pattern = re.compile("(?=(%s))" % "|".join(re.escape(term) for term in search_terms))
+    covered_terms = {term: [other for other in search_terms if other in term]
+                     for term in search_terms}
+    return pattern, covered_terms
+
+
+def count_terms(texts, pattern, covered_terms):
+    """A function to count how many pieces of text contain each search term
+
+    Args:
+        texts: An iterable of strings such as a page's text nodes
+        pattern: The pattern from build_search_pattern
+        covered_terms: The covered terms from build_search_pattern
+
+    Returns:
+        term_counts: A Counter of each term and how many texts contained it
+    """
+    term_counts = collections.Counter()
+    for text in texts:
+        found_terms = set()
+        for match in pattern.finditer(text):
+            found_terms.update(covered_terms[match.group(1)])
+        term_counts.update(found_terms)
+    return term_counts
+
+
+def row_fingerprint(row_text):
+    """A function to fingerprint a sheet row so it can be recognised on later runs
+
+    Args:
+        row_text: The text of every cell in the row joined by tabs
+
+    Returns:
+        fingerprint: A hex digest of the row
+    """
+    return hashlib.sha256(row_text.encode()).hexdigest()
+
+
+class TextNodeCounter(HTMLParser):
+    """An HTML parser that counts search terms in each text node as the page
+    is fed to it so the page is never built into a tree or held in memory.
+    It also keeps the <td> text of every table row that contains a search term
+    """
+    def __init__(self, pattern, covered_terms):
+        super().__init__()
+        self.pattern = pattern
+        self.covered_terms = covered_terms
+        self.term_counts = collections.Counter()
+        self.matching_rows = {}
+        self.text_parts = []
+        self.row_parts = None
+        self.in_data_cell = False
+
+    def flush_text(self):
+        """Count the text node that has been collected since the last tag"""
+        if self.text_parts:
+            text = "".join(self.text_parts)
+            self.text_parts.clear()
+            self.term_counts.update(count_terms([text], self.pattern, self.covered_terms))
+            # Only <td> text is kept so the <th> row numbers pubhtml adds don't change a
+            # row's fingerprint when rows are inserted or deleted above it
+            if self.row_parts is not None and self.in_data_cell and text.strip():
+                self.row_parts.append(text.strip())
+
+    def handle_data(self, data):
+        # A text node can arrive in pieces when it spans chunks so keep it until the next tag
+        self.text_parts.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_text()
+        if tag == "tr":
+            self.row_parts = []
+        elif tag == "td":
+            self.in_data_cell = True
+
+    def handle_endtag(self, tag):
+        self.flush_text()
+        if tag == "td":
+            self.in_data_cell = False
+        elif tag == "tr" and self.row_parts is not None:
+            row_text = "\t".join(self.row_parts)
+            self.row_parts = None
+            if self.pattern.search(row_text):
+                self.matching_rows[row_fingerprint(row_text)] = row_text
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush_text()
+
+    def handle_comment(self, data):
+        # BeautifulSoup's find_all(string=True) counts comments as text nodes too, but
+        # stripped_strings leaves them out of a row's text
+        self.flush_text()
+        self.term_counts.update(count_terms([data], self.pattern, self.covered_terms))
+
+    def close(self):
+        super().close()
+        self.flush_text()
+
+
+def scan_sheet(google_sheet, pattern, covered_terms, session=None, parser="stream",
+               sheet_state=None):
+    """A function to download a Google Sheet pubhtml page and count its search terms.
+    If sheet_state is given a conditional GET skips pages the server says are unchanged.
+    Pages whose content hash matches sheet_state are reported as unchanged too. The soup
+    parser checks the hash before parsing, but the stream parser scans the page while it
+    downloads, so there the hash only saves the notification and not the parsing
+
+    Args:
+        google_sheet: A public Google Sheet's pubhtml URL
+        pattern: The pattern from build_search_pattern
+        covered_terms: The covered terms from build_search_pattern
+        session: The requests Session to use (get_http_session() if None)
+        parser: "stream" to scan the page as it downloads or "soup" to parse
+            it with BeautifulSoup and lxml
+        sheet_state: The state the previous scan of this sheet returned
+
+    Returns:
+        scan: A dictionary with "unchanged" set if the page is the same as in sheet_state,
+            otherwise "term_counts" (A Counter of each term and how many text nodes contained it),
+            "matching_rows" (Each matching row's text keyed by its fingerprint) and the
+            "content_hash", "etag" and "last_modified" of the page
+    """
+    headers = {}
+    if sheet_state:
+        if sheet_state.get("etag"):
+            headers["If-None-Match"] = sheet_state["etag"]
+        if sheet_state.get("last_modified"):
+            headers["If-Modified-Since"] = sheet_state["last_modified"]
+    response = (session or get_http_session()).get(google_sheet, headers=headers, timeout=60,
+                                                   stream=(parser == "stream"))
+    if response.status_code == 304:
+        response.close()
+        return {"unchanged": True}
+    response.raise_for_status()
+    content_hash = hashlib.sha256()
+    if parser == "soup":
+        from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+        content_hash.update(response.content)
+        if sheet_state and sheet_state.get("content_hash") == content_hash.hexdigest():
+            return {"unchanged": True}
+        soup = BeautifulSoup(response.content, "lxml")
+        term_counts = count_terms(soup.find_all(string=True), pattern, covered_terms)
+        matching_rows = {}
+        for row in soup.find_all("tr"):
+            row_text = "\t".join(text for cell in row.find_all("td")
+                                  for text in cell.stripped_strings)
+            if pattern.search(row_text):
+                matching_rows[row_fingerprint(row_text)] = row_text
     else:
-        print("Email sent!")
-    # End example code #
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+        text_node_counter = TextNodeCounter(pattern, covered_terms)
+        with response:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                content_hash.update(chunk)
+                text_node_counter.feed(decoder.decode(chunk))
+        text_node_counter.feed(decoder.decode(b"", final=True))
+        text_node_counter.close()
+        term_counts = text_node_counter.term_counts
+        matching_rows = text_node_counter.matching_rows
+    if sheet_state and sheet_state.get("content_hash") == content_hash.hexdigest():
+        return {"unchanged": True}
+    return {
+        "unchanged": False,
+        "term_counts": term_counts,
+        "matching_rows": matching_rows,
+        "content_hash": content_hash.hexdigest(),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified")
+    }
+
+
+def scan_sheets(google_sheets, search_terms, workers=DEFAULT_WORKERS, parser="stream",
+                state=None):
+    """A function to scan many Google Sheets for many search terms at once
+
+    Args:
+        google_sheets: A list of public Google Sheet pubhtml URLs
+        search_terms: A list of strings to search for
+        workers: How many sheets to download at once
+        parser: Either "stream" or "soup" (See scan_sheet)
+        state: The state from load_state to skip unchanged sheets with (Scans every sheet if None)
+
+    Returns:
+        results: A list of (google_sheet, scan) tuples in the same order as google_sheets
+            where scan is from scan_sheet or None if the sheet couldn't be scanned
+    """
+    pattern, covered_terms = build_search_pattern(search_terms)
+    session = get_http_session(workers)
+    state = state or {}
+
+    def scan(google_sheet):
+        sheet_state = state.get(google_sheet)
+        # A page only counts as unchanged if it was scanned for the same terms
+        if sheet_state and sheet_state.get("search_terms") != sorted(set(search_terms)):
+            sheet_state = None
+        try:
+            return scan_sheet(google_sheet, pattern, covered_terms, session, parser, sheet_state)
+        except Exception as err:  # pylint: disable=broad-except
+            print("Error scanning %s: %s" % (google_sheet, err))
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(zip(google_sheets, executor.map(scan, google_sheets)))
+
+
+def load_state(state_file):
+    """A function to load what previous runs saw on each sheet
+
+    Args:
+        state_file: The path to the JSON state file
+
+    Returns:
+        state: A dictionary of each sheet's URL and its content hash, ETag,
+            Last-Modified, search terms and matching row fingerprints
+    """
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as json_file:
+        return json.load(json_file)
+
+
+def save_state(state_file, state):
+    """A function to atomically save what this run saw on each sheet
+
+    Args:
+        state_file: The path to the JSON state file
+        state: The state dictionary to save
+    """
+    state_dir = os.path.dirname(os.path.abspath(state_file))
+    with tempfile.NamedTemporaryFile('w', dir=state_dir, delete=False) as json_file:
+        json.dump(state, json_file)
+    os.replace(json_file.name, state_file)
 
 
 # Main function
-def main(email_address, ses_access_key, ses_secret_key, google_sheet):
+def main(email_address, ses_access_key, ses_secret_key, google_sheets,
+         search_terms=None, workers=DEFAULT_WORKERS, parser="stream", state_file=None,
+         per_sheet_email=False):
     """The main function where we do all the work
 
     Args:
         email_address: An email address to send the results to
         ses_access_key: An AWS SES Access Key
         ses_secret_key: An AWS SES Secret Key
-        google_sheet: A public Google Sheet's pubhtml URL
+        google_sheets: A list of public Google Sheet pubhtml URLs
+        search_terms: A list of breeds to search for (DEFAULT_TERMS if None)
+        workers: How many sheets to download at once
+        parser: Either "stream" or "soup" (See scan_sheet)
+        state_file: An optional JSON file to remember sheets in so only newly
+            matching rows are emailed
+        per_sheet_email: Send one email per sheet instead of a single digest
     """
-    # Instantiate email_body string
-    email_body = ""
-    # Set the breed to search for
-    search_breed = "PUG"
-    # Get the contents of the page
-    page = requests.get(google_sheet).text
-    soup = BeautifulSoup(page, "lxml")
-    # Search the rendered lowercase "soup" page for pugs
-    search_results = soup.find_all(string=re.compile('.*{0}.*'
-                                                     .format(search_breed)), recursive=True)
-    print('Found the word "{0}" {1} times\n'.format(search_breed, len(search_results)))
-    email_body = email_body + 'Found the word "{0}" {1} times\n'\
-        .format(search_breed, len(search_results)) + "\n"
-    # Send the email
-    send_email(email_address, ses_access_key, ses_secret_key, email_body)
-    sys.exit(0)
+    search_terms = search_terms or DEFAULT_TERMS
+    state = load_state(state_file) if state_file else {}
+    results = scan_sheets(google_sheets, search_terms, workers, parser, state)
+    # Sheets that were emailed are only remembered once every email has gone out
+    emailed_state = {}
+    # Results for each sheet are queued as they are read and merged into one email unless
+    # per_sheet_email is set
+    with EmailNotifier(ses_access_key, ses_secret_key, digest=not per_sheet_email) as notifier:
+        for google_sheet, scan in results:
+            if scan is None:
+                continue
+            if scan["unchanged"]:
+                print("%s is unchanged" % google_sheet)
+                continue
+            previous_rows = set(state.get(google_sheet, {}).get("rows", []))
+            if state.get(google_sheet, {}).get("search_terms") != sorted(set(search_terms)):
+                previous_rows = set()
+            new_rows = [row_text for fingerprint, row_text in scan["matching_rows"].items()
+                        if fingerprint not in previous_rows]
+            sheet_state = {
+                "content_hash": scan["content_hash"],
+                "etag": scan["etag"],
+                "last_modified": scan["last_modified"],
+                "search_terms": sorted(set(search_terms)),
+                "rows": list(scan["matching_rows"])
+            }
+            # Only email sheets with new matches when we are tracking changes
+            if state_file and not new_rows:
+                print("%s has no new matches" % google_sheet)
+                state[google_sheet] = sheet_state
+                continue
+            emailed_state[google_sheet] = sheet_state
+            # Instantiate email_body string
+            email_body = ""
+            if len(google_sheets) > 1:
+                print(google_sheet)
+                email_body = email_body + google_sheet + "\n"
+            for search_term in search_terms:
+                print('Found the word "{0}" {1} times\n'.format(search_term,
+                                                                 scan["term_counts"][search_term]))
+                email_body = email_body + 'Found the word "{0}" {1} times\n'\
+                    .format(search_term, scan["term_counts"][search_term]) + "\n"
+            if state_file:
+                email_body = email_body + "New matches:\n" + "\n".join(new_rows) + "\n"
+            notifier.send(email_address, email_body)
+    if notifier.failed:
+        print("%s emails failed so their new matches will be sent again next run"
+              % notifier.failed)
+    else:
+        state.update(emailed_state)
+    if state_file:
+        save_state(state_file, state)
+    sys.exit(1 if notifier.failed else 0)
 
 
 if __name__ == '__main__':
@@ -113,12 +583,35 @@ if __name__ == '__main__':
     PARSER.add_argument(
         '-s', '--SESSecretKey', type=str, help='AWS SES Secret Key', required=True)
     PARSER.add_argument(
-        '-g', '--GoogleSheet', type=str, help='A Google Sheet pubhtml page', required=True)
+        '-g', '--GoogleSheet', type=str, nargs='+',
+        help='One or more Google Sheet pubhtml pages', required=True)
+    PARSER.add_argument(
+        '-b', '--breeds', type=str, nargs='+', default=DEFAULT_TERMS,
+        help='The breeds to search for', required=False)
+    PARSER.add_argument(
+        '-w', '--workers', type=int, default=DEFAULT_WORKERS,
+        help='How many sheets to download at once', required=False)
+    PARSER.add_argument(
+        '-p', '--parser', type=str, default="stream", choices=["stream", "soup"],
+        help='Scan pages as they download or parse them with BeautifulSoup', required=False)
+    PARSER.add_argument(
+        '-t', '--stateFile', type=str, default=None,
+        help='A JSON file to remember sheets in so only new matching rows are emailed',
+        required=False)
+    PARSER.add_argument(
+        '-m', '--perSheetEmail', action='store_true',
+        help='Send one email per sheet instead of a single digest', required=False)
     # Array for all arguments passed to script
     ARGS = PARSER.parse_args()
     # Assign args to variables
     ARG_EMAIL = ARGS.emailAddress
     ARG_ACCESS_KEY = ARGS.SESAccessKey
     ARG_SECRET_KEY = ARGS.SESSecretKey
-    ARG_GOOGLE_SHEET = ARGS.GoogleSheet
-    main(ARG_EMAIL, ARG_ACCESS_KEY, ARG_SECRET_KEY, ARG_GOOGLE_SHEET)
+    ARG_GOOGLE_SHEETS = ARGS.GoogleSheet
+    ARG_BREEDS = ARGS.breeds
+    ARG_WORKERS = ARGS.workers
+    ARG_PARSER = ARGS.parser
+    ARG_STATE_FILE = ARGS.stateFile
+    ARG_PER_SHEET_EMAIL = ARGS.perSheetEmail
+    main(ARG_EMAIL, ARG_ACCESS_KEY, ARG_SECRET_KEY, ARG_GOOGLE_SHEETS, ARG_BREEDS, ARG_WORKERS,
+         ARG_PARSER, ARG_STATE_FILE, ARG_PER_SHEET_EMAIL)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""Check that every script stays within its startup import budget
+
+"""
+#
+# Python Script:: test_bench_startup.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+# Run with: python test_bench_startup.py
+#
+
+import unittest
+
+import bench_startup
+
+
+class StartupBudgetTest(unittest.TestCase):
+    """Run every script's --help under python -X importtime"""
+    def test_scripts_stay_within_budget(self):
+        """No script imports a heavy module or goes over its budget for --help"""
+        for script, budget_ms in bench_startup.STARTUP_BUDGETS.items():
+            with self.subTest(script=script):
+                startup_ms, heavy_modules = bench_startup.measure_startup(script, repeat=3)
+                self.assertEqual(heavy_modules, [])
+                self.assertLessEqual(startup_ms, budget_ms)
+
+
+if __name__ == '__main__':
+    unittest.main()
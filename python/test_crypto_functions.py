@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Check the retry timing and timestamp parsing in crypto_functions
+
+"""
+#
+# Python Script:: test_crypto_functions.py
+#
+# Linter:: pylint
+#
+# Copyright 2021, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+# Run with: python test_crypto_functions.py
+#
+
+import datetime
+import email.utils
+import unittest
+
+import crypto_functions
+
+
+class FakeResponse:  # pylint: disable=too-few-public-methods
+    """Just enough of a requests Response for RequestScheduler._retry_delay"""
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+
+class RetryDelayTest(unittest.TestCase):
+    """RequestScheduler._retry_delay honours Retry-After and otherwise backs off"""
+    def setUp(self):
+        self.scheduler = crypto_functions.RequestScheduler({}, backoff_base=0.5,
+                                                           backoff_cap=30)
+
+    def delay(self, headers, attempt=0):
+        """Work out the delay for a response with the given headers"""
+        # pylint: disable=protected-access
+        return self.scheduler._retry_delay(FakeResponse(headers), attempt)
+
+    def test_retry_after_seconds(self):
+        """A number of seconds is used as is"""
+        self.assertEqual(self.delay({"Retry-After": "7"}, attempt=4), 7)
+
+    def test_retry_after_date(self):
+        """An HTTP date is waited for and one in the past means no wait"""
+        future = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=20)
+        self.assertAlmostEqual(self.delay({"Retry-After": email.utils.format_datetime(
+            future, usegmt=True)}), 20, delta=2)
+        self.assertEqual(self.delay({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}), 0)
+
+    def test_backoff_is_jittered_and_capped(self):
+        """Without a usable Retry-After the delay stays under the exponential cap"""
+        for attempt in range(10):
+            cap = min(30, 0.5 * 2 ** attempt)
+            for headers in ({}, {"Retry-After": "soon"}):
+                with self.subTest(attempt=attempt, headers=headers):
+                    self.assertTrue(0 <= self.delay(headers, attempt) <= cap)
+
+
+class ParseCbproTimeTest(unittest.TestCase):
+    """parse_cbpro_time handles every timestamp shape Coinbase Pro returns"""
+    def test_timestamps(self):
+        """Z and +00 offsets with 0 to 7 fractional digits"""
+        expected = datetime.datetime(2016, 12, 8, 20, 2, 28, 538640,
+                                     tzinfo=datetime.timezone.utc)
+        for timestamp in ("2016-12-08 20:02:28.53864+00", "2016-12-08T20:02:28.538640Z",
+                          "2016-12-08T20:02:28.5386401Z"):
+            with self.subTest(timestamp=timestamp):
+                self.assertEqual(crypto_functions.parse_cbpro_time(timestamp), expected)
+        self.assertEqual(crypto_functions.parse_cbpro_time("2016-12-08 20:02:28+00"),
+                         expected.replace(microsecond=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Check the filter list line classifier and domain collapsing in dns_functions
+
+"""
+#
+# Python Script:: test_dns_functions.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+# Run with: python test_dns_functions.py
+#
+
+import unittest
+
+import dns_functions
+
+
+class ClassifyLineTest(unittest.TestCase):
+    """Every prefix in LINE_CLASSIFIERS plus bare domains and junk"""
+    def assert_classified(self, cases):
+        """Check a list of (line, rule_kind, domain) cases"""
+        for line, rule_kind, domain in cases:
+            with self.subTest(line=line):
+                self.assertEqual(dns_functions.classify_line(line), (rule_kind, domain))
+
+    def test_adguard_rules(self):
+        """|| rules are domains unless they hold a wildcard"""
+        self.assert_classified([
+            ("||ads.example.com^\n", dns_functions.RULE_DOMAIN, "ads.example.com"),
+            ("||ads.example.com^\r\n", dns_functions.RULE_DOMAIN, "ads.example.com"),
+            ("||*.example.com^\n", dns_functions.RULE_WILDCARD, "*.example.com"),
+        ])
+
+    def test_exception_rules(self):
+        """@@|| rules are exceptions unless they hold a wildcard"""
+        self.assert_classified([
+            ("@@||ok.example.com^\n", dns_functions.RULE_EXCEPTION, "ok.example.com"),
+            ("@@||*.ok.example.com^\n", dns_functions.RULE_WILDCARD, "*.ok.example.com"),
+        ])
+
+    def test_hosts_entries(self):
+        """Hosts entries give their second field and bare domains starting with a digit survive"""
+        self.assert_classified([
+            ("0.0.0.0 tracker.example.net\n", dns_functions.RULE_DOMAIN, "tracker.example.net"),
+            ("127.0.0.1 ads.example.org\n", dns_functions.RULE_DOMAIN, "ads.example.org"),
+            ("1password.com\n", dns_functions.RULE_DOMAIN, "1password.com"),
+            ("0.0.0.0\n", dns_functions.RULE_IGNORED, ""),
+        ])
+
+    def test_comments_and_blanks(self):
+        """Comments, blank lines and empty strings are ignored"""
+        self.assert_classified([
+            ("! Title: a list\n", dns_functions.RULE_IGNORED, ""),
+            ("# a hosts comment\n", dns_functions.RULE_IGNORED, ""),
+            ("\n", dns_functions.RULE_IGNORED, ""),
+            ("\r\n", dns_functions.RULE_IGNORED, ""),
+            ("", dns_functions.RULE_IGNORED, ""),
+        ])
+
+    def test_plain_lines(self):
+        """Bare domains are kept and anything else is ignored"""
+        self.assert_classified([
+            ("example.com\n", dns_functions.RULE_DOMAIN, "example.com"),
+            ("not a domain\n", dns_functions.RULE_IGNORED, "not a domain"),
+        ])
+
+
+class CollapseDomainsTest(unittest.TestCase):
+    """Subdomains of listed domains and excepted domains are dropped"""
+    def test_subdomains_are_dropped(self):
+        """Only the parent of a chain of subdomains is kept, in its original order"""
+        self.assertEqual(dns_functions.collapse_domains(
+            ["a.example.com", "other.org", "example.com", "b.a.example.com"]),
+            ["other.org", "example.com"])
+
+    def test_exceptions_drop_the_domain_and_its_subdomains(self):
+        """An exception removes the excepted domain and everything under it"""
+        self.assertEqual(dns_functions.collapse_domains(
+            ["keep.example.net", "x.keep.example.net", "ads.example.net"],
+            ["keep.example.net"]),
+            ["ads.example.net"])
+
+    def test_lookalike_domains_are_not_parents(self):
+        """A domain that only ends with another domain's text is not its subdomain"""
+        self.assertEqual(dns_functions.collapse_domains(["notexample.com", "example.com"]),
+                         ["notexample.com", "example.com"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Check how dns_to_terraform writes, skips and streams Terraform files
+
+"""
+#
+# Python Script:: test_dns_to_terraform.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+# Run with: python test_dns_to_terraform.py
+#
+
+import json
+import os
+import tempfile
+import unittest
+
+import dns_functions
+import dns_to_terraform
+
+
+class WriteTerraformFileTest(unittest.TestCase):
+    """write_terraform_file only rewrites a file when its lists changed"""
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(temp_dir.cleanup)
+        self.terraform_file = os.path.join(temp_dir.name, "list.tf")
+
+    def write(self, domains, exceptions, output_format="hcl"):
+        """Write a filter and exception list to the test file"""
+        return dns_to_terraform.write_terraform_file(self.terraform_file, [
+            ("filter_list", "Filter list", domains),
+            ("exception_list", "Exception list", exceptions)
+        ], output_format)
+
+    def test_first_write_adds_everything(self):
+        """A new file counts every domain as added and can be read back"""
+        summary = self.write(["a.example.com", "b.example.com"], ["ok.example.com"])
+        self.assertTrue(summary["changed"])
+        self.assertEqual(summary["variables"]["filter_list"], {"added": 2, "removed": 0})
+        self.assertEqual(summary["variables"]["exception_list"], {"added": 1, "removed": 0})
+        self.assertEqual(dns_to_terraform.read_terraform_hash(self.terraform_file),
+                         summary["content_hash"])
+        self.assertEqual(dns_to_terraform.read_terraform_lists(self.terraform_file), {
+            "filter_list": ["a.example.com", "b.example.com"],
+            "exception_list": ["ok.example.com"]
+        })
+
+    def test_unchanged_lists_skip_the_write(self):
+        """Writing the same lists again leaves the file alone"""
+        self.write(["a.example.com"], [])
+        inode = os.stat(self.terraform_file).st_ino
+        summary = self.write(["a.example.com"], [])
+        self.assertFalse(summary["changed"])
+        self.assertEqual(summary["variables"]["filter_list"], {"added": 0, "removed": 0})
+        self.assertEqual(os.stat(self.terraform_file).st_ino, inode)
+
+    def test_changed_lists_report_the_diff(self):
+        """Added and removed domains are counted against the previous file"""
+        self.write(["a.example.com", "b.example.com"], ["ok.example.com"])
+        summary = self.write(["b.example.com", "c.example.com", "d.example.com"], [])
+        self.assertTrue(summary["changed"])
+        self.assertEqual(summary["variables"]["filter_list"], {"added": 2, "removed": 1})
+        self.assertEqual(summary["variables"]["exception_list"], {"added": 0, "removed": 1})
+
+    def test_json_output(self):
+        """Terraform JSON keeps the hash in its header and the lists in variable defaults"""
+        self.terraform_file += ".json"
+        summary = self.write(["a.example.com"], ["ok.example.com"], "json")
+        with open(self.terraform_file, encoding="utf-8") as tf_input:
+            variables = json.load(tf_input)["variable"]
+        self.assertEqual(variables["filter_list"]["default"], ["a.example.com"])
+        self.assertEqual(variables["exception_list"]["default"], ["ok.example.com"])
+        self.assertFalse(self.write(["a.example.com"], ["ok.example.com"], "json")["changed"])
+        self.assertEqual(dns_to_terraform.read_terraform_hash(self.terraform_file),
+                         summary["content_hash"])
+
+
+class StreamListsToTerraformTest(unittest.TestCase):
+    """stream_lists_to_terraform splices entries into rendered files as they arrive"""
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(temp_dir.cleanup)
+        self.terraform_file = os.path.join(temp_dir.name, "list.tf")
+        self.domains = [f"host{number}.example.com" for number in range(50)]
+        self.rules = [(dns_functions.RULE_DOMAIN, domain) for domain in self.domains]
+        self.rules.insert(10, (dns_functions.RULE_EXCEPTION, "ok.example.com"))
+        self.rules.insert(20, (dns_functions.RULE_WILDCARD, "*.example.com"))
+
+    def read_json_shards(self, summary):
+        """Load every streamed JSON shard, failing if any is not valid JSON"""
+        shards = []
+        for shard_file in summary["files"]:
+            with open(shard_file, encoding="utf-8") as tf_input:
+                shards.append(json.load(tf_input)["variable"])
+        return shards
+
+    def test_json_shards_are_valid(self):
+        """Every JSON shard parses and together they hold every domain once"""
+        summary = dns_to_terraform.stream_lists_to_terraform(
+            self.terraform_file, iter(self.rules), shards=3, output_format="json")
+        shards = self.read_json_shards(summary)
+        self.assertEqual(len(shards), 3)
+        streamed = [domain for shard, variables in enumerate(shards)
+                    for domain in variables[f"filter_list_{shard}"]["default"]]
+        self.assertEqual(sorted(streamed), sorted(self.domains))
+        self.assertEqual(shards[0]["exception_list"]["default"], ["ok.example.com"])
+        self.assertNotIn("exception_list", shards[1])
+        self.assertEqual(summary["filter_list"]["added"], len(self.domains))
+
+    def test_empty_json_shard_is_valid(self):
+        """A shard no domain hashed to is still valid JSON with an empty list"""
+        summary = dns_to_terraform.stream_lists_to_terraform(
+            self.terraform_file, iter([(dns_functions.RULE_DOMAIN, "a.example.com")]),
+            shards=2, output_format="json")
+        shards = self.read_json_shards(summary)
+        lists = [variables[f"filter_list_{shard}"]["default"]
+                 for shard, variables in enumerate(shards)]
+        self.assertEqual(sorted(lists), [[], ["a.example.com"]])
+
+    def test_hcl_matches_the_buffered_writer(self):
+        """A streamed HCL file reads back the same as one written from sorted lists"""
+        summary = dns_to_terraform.stream_lists_to_terraform(self.terraform_file,
+                                                             iter(self.rules))
+        self.assertEqual(dns_to_terraform.read_terraform_lists(self.terraform_file), {
+            "filter_list": self.domains,
+            "exception_list": ["ok.example.com"]
+        })
+        self.assertEqual(list(summary["files"]), [self.terraform_file])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Check how portfolio.py loads, values and summarizes holdings
+
+"""
+#
+# Python Script:: test_portfolio.py
+#
+# Linter:: pylint
+#
+# Copyright 2022, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: matt@ahrenstein.com
+#
+# See LICENSE
+#
+# Run with: python test_portfolio.py
+#
+
+import os
+import tempfile
+import unittest
+
+import portfolio
+
+
+# Two BTC positions, one ETH position and a symbol with no price
+HOLDINGS_CSV = ("symbol,quantity,cost_basis\n"
+                "BTC,1,20000\n"
+                "ETH,2,3000\n"
+                " BTC ,0.5,15000\n"
+                "NOPE,10,\n")
+
+
+class PortfolioTest(unittest.TestCase):
+    """Value a small portfolio with known prices"""
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(temp_dir.cleanup)
+        holdings_file = os.path.join(temp_dir.name, "holdings.csv")
+        with open(holdings_file, "w", encoding="utf-8") as csv_file:
+            csv_file.write(HOLDINGS_CSV)
+        self.holdings = portfolio.load_holdings(holdings_file)
+        self.valuation = portfolio.value_holdings(self.holdings, {"BTC": 30000, "ETH": 2000})
+
+    def test_load_groups_positions(self):
+        """Symbols are stripped and every symbol's rows are grouped"""
+        self.assertEqual(self.holdings["symbols"], ["BTC", "ETH", "BTC", "NOPE"])
+        self.assertEqual(self.holdings["positions"],
+                         {"BTC": [0, 2], "ETH": [1], "NOPE": [3]})
+
+    def test_totals(self):
+        """Totals add up and unpriced symbols are valued at 0"""
+        self.assertEqual(list(self.valuation["values"]), [30000, 4000, 15000, 0])
+        self.assertEqual(self.valuation["total_value"], 49000)
+        self.assertEqual(self.valuation["total_cost_basis"], 38000)
+        self.assertEqual(self.valuation["unpriced"], ["NOPE"])
+
+    def test_summary_rolls_up_each_symbol(self):
+        """Positions of a symbol are combined and the largest value comes first"""
+        summary = portfolio.summarize_by_symbol(self.holdings, self.valuation)
+        self.assertEqual([row["symbol"] for row in summary], ["BTC", "ETH", "NOPE"])
+        self.assertEqual(summary[0]["quantity"], 1.5)
+        self.assertEqual(summary[0]["value"], 45000)
+        self.assertEqual(summary[0]["cost_basis"], 35000)
+        self.assertEqual(summary[0]["profit_loss"], 10000)
+        self.assertAlmostEqual(summary[0]["allocation_percent"], 45000 / 49000 * 100)
+        self.assertEqual(summary[1]["quantity"], 2)
+        self.assertIsNone(summary[2]["profit_loss_percent"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Check pug_finder's stream and soup scanners and that its EmailNotifier
+delivers over a local SMTP server
+"""
+#
+# Python Script:: test_pug_finder.py
+#
+# Linter:: pylint
+#
+# Copyright 2020, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: @ahrenstein
+#
+# See LICENSE
+#
+# Run with: python test_pug_finder.py (Needs aiosmtpd, bs4 and lxml)
+#
+
+import importlib.util
+import socket
+import unittest
+
+import pug_finder
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+def free_port():
+    """Find a local TCP port nothing is listening on"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+# A small pubhtml-style page with comments inside and between rows
+SHEET_PAGE = (b'<html><body><!-- PUG list --><table>'
+              b'<tr><th>1</th><td>PUG</td><td>Fawn <!-- PUG --> puppy</td></tr>'
+              b'<tr><th>2</th><td>BEAGLE</td><td>Tri-colour</td></tr>'
+              b'<tr><th>3</th><td>Pug mix</td><td>PUG &amp; friends</td></tr>'
+              b'</table></body></html>')
+
+
+class FakeResponse:
+    """Just enough of a requests Response for scan_sheet"""
+    status_code = 200
+    encoding = "utf-8"
+    headers = {}
+
+    def __init__(self, content):
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        """Every fake page loads"""
+
+    def iter_content(self, chunk_size):
+        """Hand the page out in small chunks to split text nodes and tags"""
+        for start in range(0, len(self.content), min(chunk_size, 7)):
+            yield self.content[start:start + 7]
+
+
+class FakeSession:  # pylint: disable=too-few-public-methods
+    """A requests Session stand-in that always returns one page"""
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, *_args, **_kwargs):
+        """Return the page"""
+        return FakeResponse(self.content)
+
+
+@unittest.skipIf(importlib.util.find_spec("bs4") is None
+                 or importlib.util.find_spec("lxml") is None, "bs4 and lxml are not installed")
+class ScanSheetTest(unittest.TestCase):
+    """The stream and soup parsers agree on counts and matching rows"""
+    def scan(self, parser):
+        """Scan SHEET_PAGE for PUG with one of the parsers"""
+        pattern, covered_terms = pug_finder.build_search_pattern(["PUG"])
+        return pug_finder.scan_sheet("http://sheet", pattern, covered_terms,
+                                     FakeSession(SHEET_PAGE), parser)
+
+    def test_parsers_agree(self):
+        """Comments are counted as text nodes by both and kept out of row text by both"""
+        stream, soup = self.scan("stream"), self.scan("soup")
+        self.assertEqual(stream["term_counts"], soup["term_counts"])
+        self.assertEqual(stream["term_counts"]["PUG"], 4)
+        self.assertEqual(stream["matching_rows"], soup["matching_rows"])
+        self.assertEqual(sorted(stream["matching_rows"].values()),
+                         ["PUG\tFawn\tpuppy", "Pug mix\tPUG & friends"])
+        self.assertEqual(stream["content_hash"], soup["content_hash"])
+
+
+class RecordingHandler:
+    """An aiosmtpd handler that keeps every message it receives"""
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_DATA(self, server, session, envelope):  # pylint: disable=invalid-name
+        """Record a message and accept it"""
+        self.envelopes.append(envelope)
+        return "250 OK"
+
+
+@unittest.skipIf(Controller is None, "aiosmtpd is not installed")
+class EmailNotifierTest(unittest.TestCase):
+    """Send through EmailNotifier to an aiosmtpd server on localhost"""
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=free_port())
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+
+    def notifier(self, **kwargs):
+        """Build a notifier that talks plain SMTP to the local server"""
+        return pug_finder.EmailNotifier(None, None, smtp_host=self.controller.hostname,
+                                        smtp_port=self.controller.port, use_tls=False, **kwargs)
+
+    def test_digest_is_one_email_per_recipient(self):
+        """More messages than batch_size still go out as a single digest"""
+        with self.notifier(digest=True, batch_size=5) as notifier:
+            for sheet in range(12):
+                notifier.send("a@example.com", f"sheet {sheet}")
+            notifier.send("b@example.com", "sheet b")
+        self.assertEqual(notifier.sent, 2)
+        self.assertEqual(sorted(envelope.rcpt_tos[0] for envelope in self.handler.envelopes),
+                         ["a@example.com", "b@example.com"])
+        digest = next(envelope.content.decode() for envelope in self.handler.envelopes
+                      if envelope.rcpt_tos == ["a@example.com"])
+        for sheet in range(12):
+            self.assertIn(f"sheet {sheet}", digest)
+
+    def test_per_message_mode_sends_every_message(self):
+        """Without digest every message is its own email"""
+        with self.notifier(batch_size=5) as notifier:
+            for sheet in range(12):
+                notifier.send("a@example.com", f"sheet {sheet}")
+        self.assertEqual(notifier.sent, 12)
+        self.assertEqual(len(self.handler.envelopes), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Check how unfollow_github_org resumes from a checkpoint file
+
+"""
+#
+# Python Script:: test_unfollow_github_org.py
+#
+# Linter:: pylint
+#
+# Copyright 2020, Matthew Ahrenstein, All Rights Reserved.
+#
+# Maintainers:
+# - Matthew Ahrenstein: @ahrenstein
+#
+# See LICENSE
+#
+# Run with: python test_unfollow_github_org.py
+#
+
+import os
+import tempfile
+import unittest
+
+import unfollow_github_org
+
+
+class ReadCheckpointTest(unittest.TestCase):
+    """read_checkpoint only resumes a finished listing for the same org"""
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(temp_dir.cleanup)
+        self.checkpoint_file = os.path.join(temp_dir.name, "checkpoint")
+
+    def read(self, lines, github_org="MyOrg"):
+        """Write checkpoint lines and read them back"""
+        with open(self.checkpoint_file, "w", encoding="utf-8") as checkpoint:
+            checkpoint.write("".join(line + "\n" for line in lines))
+        return unfollow_github_org.read_checkpoint(self.checkpoint_file, github_org)
+
+    def test_missing_file(self):
+        """No checkpoint means listing from scratch"""
+        self.assertEqual(unfollow_github_org.read_checkpoint(self.checkpoint_file, "MyOrg"),
+                         (None, set()))
+
+    def test_unfinished_listing_is_ignored(self):
+        """Repos without a listed marker after them don't count as a listing"""
+        self.assertEqual(self.read(["repo\tMyOrg/a", "repo\tMyOrg/b"]), (None, set()))
+
+    def test_finished_listing_and_done_repos(self):
+        """A finished listing is resumed along with the repos already unwatched"""
+        self.assertEqual(self.read(["repo\tMyOrg/a", "repo\tMyOrg/b", "listed\tmyorg",
+                                    "done\tMyOrg/a"]),
+                         (["MyOrg/a", "MyOrg/b"], {"MyOrg/a"}))
+
+    def test_other_org_is_ignored(self):
+        """A checkpoint for another org, or from before the org was recorded, is ignored"""
+        lines = ["repo\tOther/a", "listed\tOther", "done\tOther/a"]
+        self.assertEqual(self.read(lines), (None, set()))
+        self.assertEqual(self.read(["repo\tMyOrg/a", "listed\t", "done\tMyOrg/a"]),
+                         (None, set()))
+
+    def test_latest_listing_wins(self):
+        """A listing for this org written after another org's is resumed"""
+        self.assertEqual(self.read(["repo\tOther/a", "listed\tOther", "done\tOther/a",
+                                    "repo\tMyOrg/b", "listed\tMyOrg", "done\tMyOrg/b"]),
+                         (["MyOrg/b"], {"MyOrg/b"}))
+
+
+if __name__ == '__main__':
+    unittest.main()
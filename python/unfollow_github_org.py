@@ -16,27 +16,229 @@
 #
 
 import argparse
-from github import Github
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+# PyGithub is slow to import so it is only imported where it is used, keeping it out of --help
 
 
-def main(github_token, github_org):
+# GitHub API base URL
+GITHUB_API_URL = "https://api.github.com"
+# How many repos to ask GitHub for per page
+GITHUB_PAGE_SIZE = 100
+# How many unwatch calls to have in flight at once
+DEFAULT_WORKERS = 4
+# How many API calls to leave unused before waiting for the rate limit to reset
+RATE_LIMIT_RESERVE = 50
+# How many times to retry an unwatch that hit the rate limit
+MAX_RETRIES = 3
+# How many seconds to back off after a rate limit error that doesn't say how long to wait,
+# doubled on every retry
+RATE_LIMIT_BACKOFF = 60
+
+
+def list_org_subscriptions(gh_user, github_org):
+    """A function to list the repos in an org that a user is watching
+
+    Args:
+        gh_user: A PyGithub AuthenticatedUser
+        github_org: The GitHub organization name
+
+    Returns:
+        repos: A list of PyGithub Repository objects
+    """
+    # Only the repos the user watches are listed instead of every repo they can see
+    return [repo for repo in gh_user.get_subscriptions()
+            if repo.owner.login.lower() == github_org.lower()]
+
+
+def read_checkpoint(checkpoint_file, github_org):
+    """A function to read which repos a previous run found and unwatched
+
+    Args:
+        checkpoint_file: The path to the checkpoint file
+        github_org: The GitHub organization name the checkpoint has to be for
+
+    Returns:
+        listed_repos: The full names the previous run listed or None if it never finished listing
+            or listed another org
+        done_repos: A set of the full names the previous run unwatched
+    """
+    listed_repos = None
+    pending_repos = []
+    done_repos = set()
+    if not os.path.exists(checkpoint_file):
+        return listed_repos, done_repos
+    with open(checkpoint_file, encoding="utf-8") as checkpoint:
+        for line in checkpoint:
+            kind, _, value = line.rstrip("\n").partition("\t")
+            if kind == "repo":
+                pending_repos.append(value)
+            elif kind == "listed":
+                # A listing only counts once its end marker was written for the same org
+                if value.lower() == github_org.lower():
+                    listed_repos = pending_repos
+                else:
+                    listed_repos, done_repos = None, set()
+                pending_repos = []
+            elif kind == "done" and listed_repos is not None:
+                done_repos.add(value)
+    return listed_repos, done_repos
+
+
+class RateLimitGate:
+    """Tracks the X-RateLimit-Remaining and X-RateLimit-Reset values GitHub
+    returns and holds every worker back once the remaining calls run low
+    """
+    def __init__(self, reserve=RATE_LIMIT_RESERVE):
+        self.reserve = reserve
+        self.remaining = None
+        self.reset_time = 0
+        self.hold_time = 0
+        self.lock = threading.Lock()
+
+    def update(self, gh_acct):
+        """Record the rate limit headers from a client's last response
+        Args:
+            gh_acct: The PyGithub Github client that made the last call
+        """
+        remaining = gh_acct.rate_limiting[0]
+        reset_time = gh_acct.rate_limiting_resettime
+        with self.lock:
+            self.remaining = remaining
+            self.reset_time = reset_time
+
+    def hold(self, headers, attempt):
+        """Hold every worker back after a call hit a rate limit
+        Args:
+            headers: The headers of the rate limited response
+            attempt: How many times the call has already been retried
+        """
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        retry_after = headers.get("retry-after", "")
+        hold_time = int(headers.get("x-ratelimit-reset") or 0)
+        if retry_after.isdigit():
+            # Secondary rate limits say how long to wait and have nothing to do with the reset
+            hold_time = time.time() + int(retry_after)
+        elif headers.get("x-ratelimit-remaining") != "0" or hold_time <= time.time():
+            hold_time = time.time() + RATE_LIMIT_BACKOFF * 2 ** attempt
+        with self.lock:
+            self.hold_time = max(self.hold_time, hold_time)
+
+    def wait(self):
+        """Sleep while a rate limit is held or until it resets if too few calls are left"""
+        with self.lock:
+            delay = self.hold_time - time.time()
+            if delay > 0:
+                print(f"Rate limited, waiting {delay:.0f}s before retrying")
+            elif self.remaining is None or self.remaining > self.reserve:
+                return
+            else:
+                delay = self.reset_time - time.time()
+                if delay > 0:
+                    print(f"Only {self.remaining} API calls left, waiting {delay:.0f}s"
+                          " for the rate limit to reset")
+            if delay > 0:
+                # Holding the lock keeps every other worker waiting too
+                time.sleep(delay + 1)
+            self.remaining = None
+
+
+def unwatch_repos(github_token, repo_names, checkpoint_file=None, workers=DEFAULT_WORKERS,
+                  base_url=GITHUB_API_URL):
+    """A function to unwatch many repos at once on a bounded thread pool
+
+    Args:
+        github_token: A GitHub PAT with access to your org
+        repo_names: A list of full repo names to unwatch
+        checkpoint_file: An optional file to record each unwatched repo in
+        workers: How many unwatch calls to have in flight at once
+        base_url: The GitHub API URL (Only needed for GitHub Enterprise)
+
+    Returns:
+        failed_repos: A list of the full names that could not be unwatched
+    """
+    from github import Github, RateLimitExceededException  # pylint: disable=import-outside-toplevel
+    gate = RateLimitGate()
+    clients = threading.local()
+    checkpoint_lock = threading.Lock()
+    failed_repos = []
+
+    def unwatch(full_name):
+        # PyGithub clients are not thread safe so every worker gets its own
+        if not hasattr(clients, "gh_acct"):
+            clients.gh_acct = Github(github_token, base_url=base_url)
+            clients.gh_user = clients.gh_acct.get_user()
+        for attempt in range(MAX_RETRIES + 1):
+            gate.wait()
+            try:
+                clients.gh_user.remove_from_watched(clients.gh_acct.get_repo(full_name,
+                                                                             lazy=True))
+            except RateLimitExceededException as err:
+                gate.hold(err.headers, attempt)
+                if attempt < MAX_RETRIES:
+                    continue
+                print(f"Rate limited unwatching {full_name}")
+                failed_repos.append(full_name)
+                return
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"Error unwatching {full_name}: {err}")
+                failed_repos.append(full_name)
+                return
+            break
+        gate.update(clients.gh_acct)
+        print(f"Unwatched {full_name}")
+        with checkpoint_lock:
+            checkpoint.write(f"done\t{full_name}\n")
+            checkpoint.flush()
+
+    # Without a checkpoint file progress is written to the null device
+    with open(checkpoint_file or os.devnull, "a", encoding="utf-8") as checkpoint, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(unwatch, repo_names))
+    return failed_repos
+
+
+def main(github_token, github_org, workers=DEFAULT_WORKERS, dry_run=False,
+         checkpoint_file=None, base_url=GITHUB_API_URL):
     """The main function where we do all the work
 
     Args:
         github_token: A GitHub PAT with access to your org
         github_org: The GitHub organization name that you want to unwatch repos for
+        workers: How many unwatch calls to have in flight at once
+        dry_run: Only print the repos that would be unwatched
+        checkpoint_file: An optional file to resume an interrupted run from
+        base_url: The GitHub API URL (Only needed for GitHub Enterprise)
 
     """
+    from github import Github  # pylint: disable=import-outside-toplevel
+    listed_repos, done_repos = (read_checkpoint(checkpoint_file, github_org) if checkpoint_file
+                                else (None, set()))
+    if listed_repos is None:
+        # Instantiate GitHub access
+        gh_acct = Github(github_token, base_url=base_url, per_page=GITHUB_PAGE_SIZE)
+        gh_user = gh_acct.get_user()
+        listed_repos = [repo.full_name for repo in list_org_subscriptions(gh_user, github_org)]
+        if checkpoint_file and not dry_run:
+            # Record the whole listing at once so a resumed run can skip listing again
+            with open(checkpoint_file, "a", encoding="utf-8") as checkpoint:
+                checkpoint.write("".join(f"repo\t{full_name}\n" for full_name in listed_repos)
+                                 + f"listed\t{github_org}\n")
+    else:
+        print(f"Resuming from {checkpoint_file}")
     # Instantiate all_repos value for return
-    all_repos = []
-    # Instantiate GitHub access
-    gh_acct = Github(github_token)
-    gh_user = gh_acct.get_user()
-    for repo in gh_user.get_repos():
-        if github_org in repo.full_name:
-            all_repos.append(repo.name)
-            print("Unwatching %s" % repo.full_name)
-            gh_user.remove_from_watched(repo)
+    all_repos = [full_name for full_name in listed_repos if full_name not in done_repos]
+    print(f"{len(all_repos)} of {len(listed_repos)} watched repos in {github_org}"
+          " left to unwatch")
+    if dry_run:
+        for full_name in all_repos:
+            print(f"Would unwatch {full_name}")
+        return
+    failed_repos = unwatch_repos(github_token, all_repos, checkpoint_file, workers, base_url)
+    if failed_repos:
+        print(f"Failed to unwatch {len(failed_repos)} repos: {', '.join(failed_repos)}")
 
 
 if __name__ == '__main__':
@@ -49,9 +251,26 @@ if __name__ == '__main__':
         '-t', '--Token', type=str, help='GitHub PAT', required=True)
     PARSER.add_argument(
         '-o', '--Organization', type=str, help='GitHub Org', required=True)
+    PARSER.add_argument(
+        '-w', '--workers', type=int, default=DEFAULT_WORKERS,
+        help='How many repos to unwatch at once', required=False)
+    PARSER.add_argument(
+        '-n', '--dryRun', action='store_true',
+        help='Only print the repos that would be unwatched', required=False)
+    PARSER.add_argument(
+        '-c', '--checkpointFile', type=str, default=None,
+        help='A file to record progress in and resume an interrupted run from',
+        required=False)
+    PARSER.add_argument(
+        '-u', '--baseUrl', type=str, default=GITHUB_API_URL,
+        help='The GitHub API URL for GitHub Enterprise', required=False)
     # Array for all arguments passed to script
     ARGS = PARSER.parse_args()
     # Assign args to variables
     ARG_GH_TOKEN = ARGS.Token
     ARG_GH_ORG = ARGS.Organization
-    main(ARG_GH_TOKEN, ARG_GH_ORG)
+    ARG_WORKERS = ARGS.workers
+    ARG_DRY_RUN = ARGS.dryRun
+    ARG_CHECKPOINT_FILE = ARGS.checkpointFile
+    ARG_BASE_URL = ARGS.baseUrl
+    main(ARG_GH_TOKEN, ARG_GH_ORG, ARG_WORKERS, ARG_DRY_RUN, ARG_CHECKPOINT_FILE, ARG_BASE_URL)